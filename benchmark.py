@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Maquette log viewer
+
+usage: benchmark.py [-h] [-n LINES [LINES ...]] [-m MODELS] [-g GENERATE] [-p] [--save SAVE]
+                    [--compare COMPARE]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -n, --lines           sizes of the synthetic logs in lines (default: 10k, 1M and 10M)
+  -m, --models          number of aerosol models of the synthetic logs (default: 5)
+  -g, --generate        only write a synthetic log of the first size to this file
+  -p, --pipeline        only run the pipeline throughput benchmark (MB/s and rows/s of
+                        _get_file_text, _parse_maqt_log, _building_maqt_dataframe, save_table
+                        and the plots)
+  --save                save the pipeline throughputs to this JSON file
+  --compare             fail if a pipeline throughput drops below 80% of this JSON baseline
+
+Example:
+
+    ./benchmark.py -n 10000 1000000
+    ./benchmark.py -p -n 100000 --save baseline.json
+    ./benchmark.py -p -n 100000 --compare baseline.json
+    ./benchmark.py -g synthetic.log -n 1200000 -m 8
+
+"""
+
+__author__ = "J.Colin, CESBIO"
+__license__ = "CC BY"
+__version__ = "0.2.0"
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import subprocess
+import argparse
+import tempfile
+import threading
+import urllib.request
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+import log_viewer
+
+AEROSOL_MODELS = ['BLACKCARBON', 'DUST', 'ORGANICMATTER', 'SEASALT', 'SULPHATE']
+
+# Minimum throughput ratio to the baseline, below which a pipeline stage is reported as a regression
+REGRESSION_RATIO = 0.8
+
+
+def aerosol_models(n_models):
+    """
+    Aerosol model names: the CAMS ones, then synthetic MODELnn ones beyond them
+
+    :param n_models: number of models
+    :return: list of names
+    """
+    return AEROSOL_MODELS[:n_models] + ['MODEL%02d' % i for i in range(len(AEROSOL_MODELS), n_models)]
+
+
+def generate_maqt_log(filename, n_lines, models=AEROSOL_MODELS, seed=0, payload='pairs', collisions=False):
+    """
+    Write a synthetic MAQT log of about n_lines lines to filename
+
+    :param filename: output path
+    :param n_lines: approximate number of lines
+    :param models: aerosol model names
+    :param seed: random seed
+    :param payload: 'pairs' for [('DUST', 0.1), ...] payloads, 'dict' for {'DUST': 0.1, ...} ones
+    :param collisions: write lines holding several markers, e.g. 'ozone (total ozone) = 0.3'
+    :return: number of L1C records written
+    """
+    rng = np.random.default_rng(seed)
+    n_records = max(1, n_lines // 12)
+    dates = pd.date_range('2015-07-01', periods=n_records, freq='D')
+
+    def pairs(values):
+        if payload == 'dict':
+            return '{' + ', '.join("'%s': %.6f" % (model, value) for model, value in zip(models, values)) + '}'
+        return '[' + ', '.join("('%s', %.6f)" % (model, value) for model, value in zip(models, values)) + ']'
+
+    with open(filename, 'w') as f:
+        for date in dates:
+            props = rng.dirichlet(np.ones(len(models)))
+            weight_prev = rng.random()
+            f.write("L1C date: %s T31TCJ\n" % date.strftime('%Y%m%d'))
+            f.write("Processing tile T31TCJ\n")
+            f.write("average relative humidity: %.4f\n" % rng.uniform(20, 100))
+            f.write("temporalInterpProps: %s\n" % pairs(props))
+            f.write("INFO: couverture nuageuse (avec ombres) : %.2f%%\n" % rng.uniform(0, 100))
+            f.write("taux de cirrus %.6f\n" % rng.random())
+            f.write("ozone%s = %.6f\n" % (" (total ozone)" if collisions else "", rng.uniform(0.2, 0.4)))
+            f.write("weightPrevCAMSdate%s: %.6f\n" % (" (prev AOT)" if collisions else "", weight_prev))
+            f.write("weightNextCAMSdate: %.6f\n" % (1 - weight_prev))
+            f.write("prev AOT: %s\n" % pairs(rng.random(len(models)) / 10))
+            f.write("next AOT: %s\n" % pairs(rng.random(len(models)) / 10))
+            f.write("End of processing\n")
+
+    return n_records
+
+
+def legacy_parse_maqt_log(log, raw):
+    """Reference parser: ten uncompiled re.search calls per line, as in log_viewer 0.2.0"""
+    date_list = []
+    rh_list = []
+    props_list = []
+    cloud_list = []
+    cirrus_list = []
+    ozone_list = []
+    weight_prev_cams_date_list = []
+    weight_next_cams_date_list = []
+    prev_aot_list = []
+    next_aot_list = []
+    props_arr = None
+
+    for line in range(len(raw)):
+        if re.search(log.regex_maqt_date, raw[line]) is not None:
+            date_list.append(pd.to_datetime(raw[line][10:18], format='%Y%m%d'))
+        if re.search(log.regex_maqt_rh, raw[line]) is not None:
+            rh_list.append(float(raw[line].split(':')[1]))
+        if re.search(log.regex_maqt_cams_ratio, raw[line]) is not None:
+            temporal_interp_props = OrderedDict(sorted(eval(raw[line].split(':')[1])))
+            if not props_list:
+                props_arr = np.array(list(temporal_interp_props.values()))
+                props_list = temporal_interp_props.keys()
+            else:
+                props_arr = np.vstack((props_arr, list(temporal_interp_props.values())))
+        if re.search(log.regex_maqt_cloud_fraction, raw[line]) is not None:
+            cloud_list.append(float(raw[line].split(':')[2].strip('%\n')) / 100)
+        if re.search(log.regex_maqt_cirrus_fraction, raw[line]) is not None:
+            cirrus_list.append(log._extract_float_from_text(raw[line], 14, upto=True))
+        if re.search(log.regex_maqt_ozone, raw[line]) is not None:
+            ozone_list.append(log._extract_float_from_text(raw[line], 1, '='))
+        if re.search(log.regex_maqt_weight_prev_cams_date, raw[line]) is not None:
+            weight_prev_cams_date_list.append(log._extract_float_from_text(raw[line], 1, ':'))
+        if re.search(log.regex_maqt_weight_next_cams_date, raw[line]) is not None:
+            weight_next_cams_date_list.append(log._extract_float_from_text(raw[line], 1, ':'))
+        if re.search(log.regex_maqt_prev_aot, raw[line]) is not None:
+            prev_aot_dict = OrderedDict(sorted(eval(raw[line].split(':')[1])))
+            prev_aot_list.append(np.array(list(prev_aot_dict.values())).sum())
+        if re.search(log.regex_maqt_next_aot, raw[line]) is not None:
+            next_aot_dict = OrderedDict(sorted(eval(raw[line].split(':')[1])))
+            next_aot_list.append(np.array(list(next_aot_dict.values())).sum())
+
+    return date_list, rh_list, props_arr, props_list, cloud_list, cirrus_list, ozone_list, \
+           weight_prev_cams_date_list, weight_next_cams_date_list, prev_aot_list, next_aot_list
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def _same_columns(a, b):
+    return all(np.array_equal(np.asarray(list(col_a)), np.asarray(list(col_b))) for col_a, col_b in zip(a, b))
+
+
+def _parse_and_convert_dates(log, raw):
+    columns = log._parse_maqt_log(raw)
+    return (list(pd.to_datetime(log_viewer._yyyymmdd_to_datetime64(columns[0]))),) + columns[1:]
+
+
+def bench_parser(sizes, workdir):
+    print("== _parse_maqt_log: single-pass dispatch vs legacy ten re.search loop ==")
+    print("%12s %12s %12s %10s" % ("lines", "legacy (s)", "dispatch (s)", "speedup"))
+    for n_lines in sizes:
+        filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+        generate_maqt_log(filename, n_lines)
+        log = log_viewer.Log(filename, keep_raw=True)
+
+        t_legacy, legacy = _timed(legacy_parse_maqt_log, log, log._raw)
+        t_dispatch, dispatch = _timed(_parse_and_convert_dates, log, log._raw)
+        if not _same_columns(legacy, dispatch):
+            print("ERROR: parsers disagree on %s" % filename)
+            sys.exit(1)
+
+        print("%12d %12.3f %12.3f %9.1fx" % (n_lines, t_legacy, t_dispatch, t_legacy / t_dispatch))
+        os.remove(filename)
+
+
+def bench_decoder(n_records=100000, models=AEROSOL_MODELS):
+    print("== temporalInterpProps / AOT payloads: PairsDecoder vs eval + OrderedDict(sorted(...)) ==")
+    rng = np.random.default_rng(0)
+    payloads = [' [' + ', '.join("('%s', %.6f)" % (model, value) for model, value in zip(models, values)) + ']\n'
+                for values in rng.random((n_records, len(models)))]
+
+    def with_eval():
+        return [list(OrderedDict(sorted(eval(payload))).values()) for payload in payloads]
+
+    def with_decoder():
+        decoder = log_viewer.PairsDecoder()
+        return [decoder.decode(payload)[1] for payload in payloads]
+
+    t_eval, evaluated = _timed(with_eval)
+    t_decoder, decoded = _timed(with_decoder)
+    if evaluated != decoded:
+        print("ERROR: decoder disagrees with eval")
+        sys.exit(1)
+
+    print("%12s %12s %12s %10s" % ("records", "eval (s)", "decoder (s)", "speedup"))
+    print("%12d %12.3f %12.3f %9.1fx" % (n_records, t_eval, t_decoder, t_eval / t_decoder))
+
+
+def bench_props_scaling(records=(1000, 10000, 100000, 1000000), models=AEROSOL_MODELS):
+    print("== temporalInterpProps accumulation: parse time per record ==")
+    print("%12s %12s %14s" % ("records", "parse (s)", "per record (us)"))
+    rng = np.random.default_rng(0)
+    per_record = []
+    for n_records in records:
+        lines = ["temporalInterpProps: [" + ', '.join("('%s', %.6f)" % (model, value)
+                                                      for model, value in zip(models, values)) + "]\n"
+                 for values in rng.dirichlet(np.ones(len(models)), n_records)]
+        log_parser = log_viewer.MaqtParser(OrderedDict([('cams_ratio', "^temporalInterpProps")]))
+
+        def parse():
+            for line in lines:
+                log_parser.feed(line)
+            return log_parser.props_arr
+
+        t_parse, props_arr = _timed(parse)
+        assert props_arr.shape == (n_records, len(models))
+        per_record.append(t_parse / n_records)
+        print("%12d %12.3f %14.2f" % (n_records, t_parse, 1e6 * per_record[-1]))
+
+    # Linear growth: the cost of one record must not depend on the number of records
+    if max(per_record) > 3 * min(per_record):
+        print("ERROR: aerosol proportions parsing does not scale linearly")
+        sys.exit(1)
+
+
+def bench_dates(n_records=200000):
+    print("== L1C dates: per-line pd.to_datetime vs one vectorized YYYYMMDD conversion ==")
+    dates = [date.strftime('%Y%m%d') for date in pd.date_range('1900-01-01', periods=n_records, freq='D')]
+    int_dates = [int(date) for date in dates]
+
+    def per_line():
+        return [pd.to_datetime(date, format='%Y%m%d') for date in dates]
+
+    def vectorized():
+        return pd.DatetimeIndex(log_viewer._yyyymmdd_to_datetime64(int_dates))
+
+    t_per_line, parsed = _timed(per_line)
+    t_vectorized, converted = _timed(vectorized)
+    if not (converted == pd.DatetimeIndex(parsed)).all():
+        print("ERROR: vectorized dates disagree with per-line dates")
+        sys.exit(1)
+
+    print("%12s %12s %14s %10s" % ("records", "per line (s)", "vectorized (s)", "speedup"))
+    print("%12d %12.3f %14.3f %9.1fx" % (n_records, t_per_line, t_vectorized, t_per_line / t_vectorized))
+
+
+def bench_scan(sizes, workdir):
+    print("== Log: streamed text lines vs mmap bytes scanning ==")
+    # Lines holding several markers go to a single field, whatever the path
+    filename = os.path.join(workdir, "bench_collisions.log")
+    generate_maqt_log(filename, 1200, collisions=True)
+    if not log_viewer.Log(filename, mmap_threshold=None).df.equals(log_viewer.Log(filename, mmap_threshold=0).df):
+        print("ERROR: mmap scanning disagrees with text parsing on lines holding several markers")
+        sys.exit(1)
+    os.remove(filename)
+
+    print("%12s %12s %12s %10s" % ("lines", "text (s)", "mmap (s)", "speedup"))
+    for n_lines in sizes:
+        filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+        generate_maqt_log(filename, n_lines)
+
+        t_text, text_log = _timed(log_viewer.Log, filename, False, False, False, None)
+        t_mmap, mmap_log = _timed(log_viewer.Log, filename, False, False, False, 0)
+        if not text_log.df.equals(mmap_log.df):
+            print("ERROR: mmap scanning disagrees with text parsing on %s" % filename)
+            sys.exit(1)
+
+        print("%12d %12.3f %12.3f %9.1fx" % (n_lines, t_text, t_mmap, t_text / t_mmap))
+        os.remove(filename)
+
+
+def bench_pushdown(sizes, workdir):
+    print("== Log: fields and date window pushed down to the parser ==")
+    print("%12s %-28s %12s %10s %10s" % ("lines", "selection", "parse (s)", "records", "speedup"))
+    selections = [('all fields', {}),
+                  ('cloud_fraction', {'fields': ['cloud_fraction']}),
+                  ('one month', {'date_from': '2016-01-01', 'date_to': '2016-01-31'}),
+                  ('cloud_fraction, one month', {'fields': ['cloud_fraction'], 'date_from': '2016-01-01',
+                                                 'date_to': '2016-01-31'})]
+    for n_lines in sizes:
+        filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+        generate_maqt_log(filename, n_lines)
+
+        t_full, full_log = _timed(log_viewer.Log, filename)
+        for name, selection in selections:
+            t_selection, log = _timed(lambda: log_viewer.Log(filename, **selection))
+            expected = full_log.df
+            if 'date_from' in selection:
+                expected = full_log.between(selection['date_from'], selection['date_to']).reset_index(drop=True)
+            if not log.df.equals(expected[list(log.df.columns)]):
+                print("ERROR: %s pushed down disagrees with a full parse on %s" % (name, filename))
+                sys.exit(1)
+
+            print("%12d %-28s %12.3f %10d %9.1fx" % (n_lines, name, t_selection, len(log.df), t_full / t_selection))
+        os.remove(filename)
+
+
+def bench_index(n_lines, workdir):
+    print("== Log: one date seeked through the sidecar index vs scanned ==")
+    print("%12s %12s %12s %12s %10s" % ("lines", "build (s)", "scan (s)", "indexed (s)", "speedup"))
+    filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+    generate_maqt_log(filename, n_lines)
+    index = log_viewer.LogIndex()
+
+    t_build, _ = _timed(index.build, filename)
+    t_scan, scan_log = _timed(lambda: log_viewer.Log(filename, date_from='2016-01-01', date_to='2016-01-01'))
+    t_indexed, indexed_log = _timed(lambda: log_viewer.Log(filename, date_from='2016-01-01', date_to='2016-01-01',
+                                                           index=index))
+    if not scan_log.df.equals(indexed_log.df):
+        print("ERROR: indexed parsing disagrees with scanned parsing on %s" % filename)
+        sys.exit(1)
+
+    print("%12d %12.3f %12.3f %12.3f %9.1fx" % (n_lines, t_build, t_scan, t_indexed, t_scan / t_indexed))
+    os.remove(filename)
+    os.remove(filename + index.suffix)
+
+
+def bench_jobs(n_lines, workdir, workers=(1, 4, 16, 32)):
+    print("== Log: parallel chunked parsing (%d CPUs available) ==" % os.cpu_count())
+    print("%12s %12s %12s %10s" % ("lines", "jobs", "parse (s)", "speedup"))
+    filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+    generate_maqt_log(filename, n_lines)
+
+    t_serial, serial_log = _timed(log_viewer.Log, filename, False, False, False, None)
+    for jobs in workers:
+        t_jobs, jobs_log = _timed(log_viewer.Log, filename, False, False, False, None, jobs)
+        if not serial_log.df.equals(jobs_log.df):
+            print("ERROR: parallel parsing disagrees with serial parsing on %s" % filename)
+            sys.exit(1)
+
+        print("%12d %12d %12.3f %9.1fx" % (n_lines, jobs, t_jobs, t_serial / t_jobs))
+    os.remove(filename)
+
+
+def _import_time_ms(statement):
+    """Cumulative import time in ms of the top-level modules imported by statement, from python -X importtime"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], check=True, capture_output=True,
+                         text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    total = 0
+    for line in out.stderr.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit() and not fields[2].startswith('  '):
+            total += int(fields[1])
+
+    return total / 1000
+
+
+def bench_startup(workdir, n_lines=1200):
+    print("== Cold start: table-only runs vs runs importing matplotlib ==")
+    print("%30s %12s" % ("", "time (ms)"))
+    print("%30s %12.1f" % ("import log_viewer", _import_time_ms("import log_viewer")))
+    print("%30s %12.1f" % ("import log_viewer + pylab", _import_time_ms("import log_viewer, pylab")))
+
+    filename = os.path.join(workdir, "bench_startup.log")
+    generate_maqt_log(filename, n_lines)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log_viewer.py')
+    for label, options in (("log_viewer.py --table-only", ['--table-only']), ("log_viewer.py", [])):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script] + options + [filename], check=True, capture_output=True, cwd=workdir)
+        t_run = time.perf_counter() - start
+        print("%30s %12.1f" % (label, 1000 * t_run))
+    os.remove(filename)
+
+
+def bench_server(n_lines, workdir, n_requests=20):
+    print("== One day's table: cold log_viewer.py runs vs requests to a warm server ==")
+    print("%30s %12s" % ("", "time (ms)"))
+    filename = os.path.join(workdir, "bench_server.log")
+    generate_maqt_log(filename, n_lines)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log_viewer.py')
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script, '--no-cache', '--table-only', '--from', '2016-01-01', '--to', '2016-01-01',
+                    filename], check=True, capture_output=True, cwd=workdir)
+    print("%30s %12.1f" % ("log_viewer.py", 1000 * (time.perf_counter() - start)))
+
+    server = log_viewer.make_server(workdir, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:%d/table/bench_server.log?from=2016-01-01&to=2016-01-01" % server.server_address[1]
+        t_first, body = _timed(lambda: urllib.request.urlopen(url).read())
+        t_warm, _ = _timed(lambda: [urllib.request.urlopen(url).read() for _ in range(n_requests)])
+        print("%30s %12.1f" % ("first request (parse)", 1000 * t_first))
+        print("%30s %12.1f" % ("warm request", 1000 * t_warm / n_requests))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if len(json.loads(body)) != len(log_viewer.Log(filename).between('2016-01-01', '2016-01-01')):
+        print("ERROR: served table disagrees with the parsed log %s" % filename)
+        sys.exit(1)
+    os.remove(filename)
+
+
+def bench_compression(n_lines, workdir):
+    print("== Compressed logs: streamed decompression vs decompress-then-parse ==")
+    print("%12s %12s %16s %12s %10s" % ("lines", "format", "decompress (s)", "stream (s)", "speedup"))
+    filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+    generate_maqt_log(filename, n_lines)
+    reference = log_viewer.Log(filename).df
+
+    for compression, (_, opener, suffix) in log_viewer.COMPRESSION_FORMATS.items():
+        if compression == 'zstd' and log_viewer.zstandard is None:
+            continue
+
+        compressed = filename + suffix
+        with open(filename, 'rb') as f_in:
+            if compression == 'zstd':
+                with open(compressed, 'wb') as f_out:
+                    log_viewer.zstandard.ZstdCompressor().copy_stream(f_in, f_out)
+            else:
+                with opener(compressed, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+
+        def decompress_then_parse():
+            decompressed = os.path.join(workdir, "decompressed.log")
+            with log_viewer.Log._open_file(compressed) as f_in, open(decompressed, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            log = log_viewer.Log(decompressed, mmap_threshold=0)
+            os.remove(decompressed)
+            return log
+
+        t_decompress, _ = _timed(decompress_then_parse)
+        t_stream, stream_log = _timed(log_viewer.Log, compressed, False, False, False, 0)
+        if not reference.equals(stream_log.df):
+            print("ERROR: streamed %s parsing disagrees with plain parsing" % compression)
+            sys.exit(1)
+
+        print("%12d %12s %16.3f %12.3f %9.1fx" % (n_lines, compression, t_decompress, t_stream,
+                                                  t_decompress / t_stream))
+        os.remove(compressed)
+    os.remove(filename)
+
+
+def bench_render(workdir, records=(1000, 10000, 100000)):
+    print("== plot_aerosols: one bar per date vs filled step areas ==")
+    print("%12s %12s %12s %10s" % ("dates", "bars (s)", "steps (s)", "speedup"))
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for n_records in records:
+            filename = os.path.join(workdir, "bench_render_%d.log" % n_records)
+            generate_maqt_log(filename, 12 * n_records)
+            log = log_viewer.Log(filename)
+
+            t_bars, _ = _timed(log.plot_aerosols, False)
+            t_steps, _ = _timed(log.plot_aerosols, True)
+            print("%12d %12.3f %12.3f %9.1fx" % (n_records, t_bars, t_steps, t_bars / t_steps))
+            os.remove(filename)
+    finally:
+        os.chdir(cwd)
+
+
+def bench_render_workers(workdir, n_logs=8, n_records=10000, workers=(1, 2, 4, 8)):
+    print("== render_plots: figures of %d logs over a process pool (%d CPUs available) ==" % (n_logs, os.cpu_count()))
+    print("%12s %12s %12s %10s" % ("figures", "workers", "render (s)", "speedup"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        logs = []
+        for i in range(n_logs):
+            filename = os.path.join(workdir, "bench_render_workers_%d.log" % i)
+            generate_maqt_log(filename, 12 * n_records, seed=i)
+            logs.append(log_viewer.Log(filename))
+            os.remove(filename)
+
+        t_serial, _ = _timed(log_viewer.render_plots, logs, 1)
+        for n_workers in workers:
+            t_workers, _ = _timed(log_viewer.render_plots, logs, n_workers)
+            print("%12d %12d %12.3f %9.1fx" % (2 * n_logs, n_workers, t_workers, t_serial / t_workers))
+    finally:
+        os.chdir(cwd)
+
+
+def bench_pipeline(sizes, workdir, models=AEROSOL_MODELS):
+    """
+    Throughput of each stage of the Log pipeline, in MB/s of log and rows/s of DataFrame
+
+    :param sizes: sizes of the synthetic logs in lines
+    :param workdir: directory of the logs and outputs
+    :param models: aerosol model names
+    :return: list of dicts, one per size and stage
+    """
+    print("== Log pipeline throughput (%d aerosol models) ==" % len(models))
+    print("%12s %-24s %10s %10s %14s" % ("lines", "stage", "time (s)", "MB/s", "rows/s"))
+    results = []
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # Import matplotlib beforehand, for the first plots not to be timed with it
+        log_viewer._new_figure()
+        for n_lines in sizes:
+            filename = os.path.join(workdir, "bench_pipeline_%d.log" % n_lines)
+            n_records = generate_maqt_log(filename, n_lines, models)
+            size_mb = os.path.getsize(filename) / 1024 ** 2
+            log = log_viewer.Log(filename, mmap_threshold=None)
+
+            t_read, (raw, _) = _timed(log._get_file_text, filename)
+            stages = [('_get_file_text', t_read),
+                      ('_parse_maqt_log', _timed(log._parse_maqt_log, raw)[0]),
+                      ('_building_maqt_dataframe', _timed(log._building_maqt_dataframe)[0]),
+                      ('save_table', _timed(log.save_table)[0])]
+            del raw
+            if n_records <= 100000:
+                stages.append(('plots', _timed(log_viewer.render_plots, [log])[0]))
+
+            for stage, seconds in stages:
+                result = {'lines': n_lines, 'stage': stage, 'seconds': seconds, 'mb_per_s': size_mb / seconds,
+                          'rows_per_s': n_records / seconds}
+                results.append(result)
+                print("%12d %-24s %10.3f %10.1f %14.0f" % (n_lines, stage, seconds, result['mb_per_s'],
+                                                           result['rows_per_s']))
+            os.remove(filename)
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+
+def check_regressions(results, baseline_file, ratio=REGRESSION_RATIO):
+    """
+    Compare pipeline throughputs to a baseline saved by --save
+
+    :param results: bench_pipeline results
+    :param baseline_file: JSON file of former results
+    :param ratio: minimum throughput ratio to the baseline
+    :return: list of (lines, stage, baseline rows/s, rows/s) below the ratio
+    """
+    with open(baseline_file) as f:
+        baseline = {(result['lines'], result['stage']): result['rows_per_s'] for result in json.load(f)}
+
+    return [(result['lines'], result['stage'], baseline[result['lines'], result['stage']], result['rows_per_s'])
+            for result in results if (result['lines'], result['stage']) in baseline
+            and result['rows_per_s'] < ratio * baseline[result['lines'], result['stage']]]
+
+
+def _peak_rss_mb(filename, keep_raw):
+    """Peak RSS in MB of a fresh interpreter building a Log from filename"""
+    # VmHWM is reset by exec, unlike ru_maxrss which inherits the parent peak
+    probe = "import log_viewer; log_viewer.Log(%r, keep_raw=%r, mmap_threshold=None); " \
+            "print([l.split()[1] for l in open('/proc/self/status') if l.startswith('VmHWM')][0])" \
+            % (filename, keep_raw)
+    out = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return int(out.stdout.split()[-1]) / 1024
+
+
+def bench_memory(sizes, workdir):
+    print("== Log peak RSS: streamed lines vs readlines() ==")
+    print("%12s %12s %12s %14s" % ("lines", "file (MB)", "raw (MB)", "streamed (MB)"))
+    peak_rss = []
+    for n_lines in sizes:
+        filename = os.path.join(workdir, "bench_%d.log" % n_lines)
+        generate_maqt_log(filename, n_lines)
+        file_mb = os.path.getsize(filename) / 1024 ** 2
+
+        raw_mb = _peak_rss_mb(filename, True)
+        streamed_mb = _peak_rss_mb(filename, False)
+        peak_rss.append((file_mb, streamed_mb))
+
+        print("%12d %12.1f %12.1f %14.1f" % (n_lines, file_mb, raw_mb, streamed_mb))
+        os.remove(filename)
+
+    # Streaming into typed columns holds neither the text nor boxed values: RSS grows slower than the input
+    (file_first, streamed_first), (file_last, streamed_last) = peak_rss[0], peak_rss[-1]
+    if len(peak_rss) > 1 and streamed_last - streamed_first > file_last - file_first:
+        print("ERROR: streamed peak RSS grows faster than the input size")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--lines", help="Sizes of the synthetic logs in lines", type=int, nargs='+',
+                        default=[10000, 1000000, 10000000])
+    parser.add_argument("-m", "--models", help="Number of aerosol models of the synthetic logs", type=int,
+                        default=len(AEROSOL_MODELS))
+    parser.add_argument("-g", "--generate", help="Only write a synthetic log of the first size to this file")
+    parser.add_argument("-p", "--pipeline", help="Only run the pipeline throughput benchmark", action="store_true")
+    parser.add_argument("--save", help="Save the pipeline throughputs to this JSON file")
+    parser.add_argument("--compare", help="Fail if a pipeline throughput drops below %d%% of this JSON baseline"
+                                          % (100 * REGRESSION_RATIO))
+
+    args = parser.parse_args()
+    models = aerosol_models(args.models)
+
+    if args.generate is not None:
+        n_records = generate_maqt_log(args.generate, args.lines[0], models)
+        print("INFO: wrote %d records to %s" % (n_records, args.generate))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = bench_pipeline(args.lines, workdir, models)
+        if args.save is not None:
+            with open(args.save, 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if args.compare is not None:
+            regressions = check_regressions(results, args.compare)
+            for n_lines, stage, baseline, rows_per_s in regressions:
+                print("ERROR: %s on %d lines: %.0f rows/s, baseline %.0f rows/s" % (stage, n_lines, rows_per_s,
+                                                                                  baseline))
+            if regressions:
+                sys.exit(1)
+
+        if args.pipeline:
+            sys.exit(0)
+
+        bench_startup(workdir)
+        bench_server(max(args.lines), workdir)
+        bench_decoder()
+        bench_props_scaling()
+        bench_dates()
+        bench_parser(args.lines, workdir)
+        bench_scan(args.lines, workdir)
+        bench_pushdown(args.lines, workdir)
+        bench_index(max(args.lines), workdir)
+        bench_jobs(max(args.lines), workdir)
+        bench_compression(max(args.lines), workdir)
+        bench_render(workdir)
+        bench_render_workers(workdir)
+        bench_memory(args.lines, workdir)
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,73 @@
 """
 Maquette log viewer utility
 
-usage: log_viewer.py [-h] [-v] [-t] FILE
+usage: log_viewer.py [-h] [-v] [-t] [-j JOBS] [-w WORKERS] [-p PLOT_WORKERS] [-m MERGE] [-s SUMMARY] [--no-plots]
+                     [-f {csv,parquet,feather,txt}] [--no-cache] [--follow SECONDS]
+                     [--resample {mean,max,lttb}] [--bins BINS] [--from DATE_FROM] [--to DATE_TO]
+                     [--fields FIELD[,FIELD...]] [--index] [--serve PORT] [--host HOST]
+                     [--server-memory SERVER_MEMORY] [--profile] [--pstats PSTATS]
+                     FILE [FILE ...]
 
 positional arguments:
-  FILE                  Maquette LOG output
+  FILE                  Maquette LOG output(s), or glob pattern(s) of them
 
 optional arguments:
   -h, --help            show this help message and exit
   -v, --verbose         set verbosity to INFO level (includes stats)
   -t, --tau             use CAMS AOT in stack bars plot
+  -j, --jobs            number of processes parsing the log in parallel
+  -w, --workers         number of processes handling the logs of a batch
+  -p, --plot-workers    number of processes rendering the plots, shared by the logs of a batch
+                        run with a single worker
+  -m, --merge           write the date-sorted, de-duplicated records of all the logs, or of the single
+                        one, to this table file, with their log file as Source column
+  -s, --summary         write the per-file status of the logs, or of the single one, to this CSV file
+  --no-plots, --table-only
+                        only save the table, without loading matplotlib
+  -f, --format          table file format: csv (default), parquet, feather (both need pyarrow)
+                        or txt (fixed-width text)
+  --no-cache            always parse the logs, without reading or writing the parse cache
+                        ($LOG_VIEWER_CACHE, default ~/.cache/log_viewer)
+  --follow SECONDS      keep parsing the lines appended to the log every SECONDS and update the
+                        plots and table, until interrupted
+  --resample            downsample the plotted series of long logs to BINS dates: mean or max over
+                        bins of equal duration, or lttb (Largest-Triangle-Three-Buckets)
+  --bins                number of dates of resampled plots (default 500)
+  --from                only parse, plot and save the records from this date on, e.g. 2015-07-01
+  --to                  only parse, plot and save the records up to this date, included
+  --fields              only parse these comma-separated fields besides the dates, some of rh,
+                        cams_ratio, cloud_fraction, cirrus_fraction, ozone, weight_prev_cams_date,
+                        weight_next_cams_date, prev_aot and next_aot. Plots missing their
+                        fields are not drawn. The parse cache is bypassed with --from, --to
+                        or --fields
+  --index               seek the records from --from to --to through a sidecar index of each log
+                        (<log>.idx), built on first use and rebuilt when the log changes
+  --serve PORT          serve the tables and plots of the logs of the FILE directory, or of the
+                        directory of the FILE logs, over HTTP, keeping the parsed logs in memory
+                        and parsing them again once changed:
+                          GET /table/<log>?format=json|csv&from=DATE&to=DATE&columns=COL,...
+                          GET /plot/<log>?kind=aerosols|clouds&from=DATE&to=DATE&resample=lttb&bins=N&tau=1
+                          GET /status
+  --host                listening address of --serve (default 127.0.0.1)
+  --server-memory       memory bound in MB of the parsed logs and plots kept by --serve (default 512)
+  --profile             print the wall time, CPU time and peak memory of each stage (read and
+                        parse, total AOT, DataFrame build, describe, plots, save table), and the
+                        number of lines and parse time of each field. The parse cache is bypassed
+  --pstats              dump cProfile statistics of the run to this file
 
 returns:
   Plot files as PNG
-  Table ASCII csv file
+  Table file as CSV, Parquet, Feather or fixed-width text
+  Per-file status summary, for a batch of several logs or with -s
 
 Example:
 
     ./log_viewer.py -v toto.log
+    ./log_viewer.py -w 8 -s summary.csv "logs/*.log"
+    ./log_viewer.py -w 8 --no-plots -m T31TCJ_2015.csv "logs/T31TCJ_2015*.log"
+    ./log_viewer.py --fields cloud_fraction --from 2015-07-01 --to 2015-07-31 toto.log
+    ./log_viewer.py --index --no-plots --from 2015-07-14 --to 2015-07-14 big.log
+    ./log_viewer.py --serve 8150 logs/
 
 """
 
@@ -26,24 +76,963 @@ __author__ = "J.Colin, CESBIO"
 __license__ = "CC BY"
 __version__ = "0.2.0"
 
+import io
+import os
+import copy
+import bz2
 import sys
+import glob
+import json
+import gzip
+import lzma
+import mmap
+import time
+import queue
+import cProfile
+import hashlib
 import argparse
+import functools
+import resource
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from array import array
+import http.server
+import urllib.parse
+import concurrent.futures
 import numpy as np
-import pylab as pl
 import pandas as pd, re
 from collections import OrderedDict
-from pandas.plotting import register_matplotlib_converters
 
-register_matplotlib_converters()
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Table export formats: format -> (output file suffix, DataFrame writer)
+TABLE_FORMATS = OrderedDict([('csv', ('_table.csv', lambda df, path: df.to_csv(path, index=False))),
+                             ('parquet', ('_table.parquet', lambda df, path: df.to_parquet(path, index=False))),
+                             ('feather', ('_table.feather', lambda df, path: df.to_feather(path))),
+                             ('txt', ('_table.txt', lambda df, path: df.to_string(path)))])
+
+# Parse cache location and size bound
+CACHE_DIR = os.environ.get('LOG_VIEWER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'log_viewer'))
+CACHE_MAX_BYTES = 1024 ** 3
+
+# Log files from this size on are scanned as bytes through mmap instead of being decoded line by line
+MMAP_THRESHOLD = 64 * 1024 ** 2
+
+# Above this number of dates, bar plots are drawn as filled step areas, one artist per series
+STEP_PLOT_THRESHOLD = 1000
+
+# Plot resampling methods, and default number of bins of resampled plots
+RESAMPLE_METHODS = ('mean', 'max', 'lttb')
+RESAMPLE_BINS = 500
+
+# Server mode: default port, and memory bound of the parsed logs and plots kept warm
+SERVER_PORT = 8150
+SERVER_MAX_BYTES = 512 * 1024 ** 2
+
+# Fields of a MAQT record which can be selected for parsing, besides the L1C date always parsed
+MAQT_FIELDS = ('rh', 'cams_ratio', 'cloud_fraction', 'cirrus_fraction', 'ozone', 'weight_prev_cams_date',
+               'weight_next_cams_date', 'prev_aot', 'next_aot')
+
+# Size of the decompressed blocks scanned as bytes for compressed logs
+STREAM_BLOCK_SIZE = 16 * 1024 ** 2
+
+
+def _zstd_open(filename, mode='rb'):
+    if zstandard is None:
+        raise ImportError("reading zstd-compressed logs requires the zstandard package")
+
+    return zstandard.ZstdDecompressor().stream_reader(open(filename, mode), read_across_frames=True, closefd=True)
+
+
+# Compressed log formats: format -> (magic bytes, opener of a decompressing binary file object, file suffix)
+COMPRESSION_FORMATS = OrderedDict([('gzip', (b'\x1f\x8b', gzip.open, '.gz')),
+                                   ('bz2', (b'BZh', bz2.open, '.bz2')),
+                                   ('xz', (b'\xfd7zXZ\x00', lzma.open, '.xz')),
+                                   ('zstd', (b'\x28\xb5\x2f\xfd', _zstd_open, '.zst'))])
+
+
+def detect_compression(filename):
+    """
+    Compression format of a file, from its magic bytes
+
+    :param filename: file to check
+    :return: one of COMPRESSION_FORMATS, or None if uncompressed or unreadable
+    """
+    try:
+        with open(filename, 'rb') as f:
+            magic = f.read(6)
+
+    except OSError:
+        return None
+
+    for compression, (prefix, _, _) in COMPRESSION_FORMATS.items():
+        if magic.startswith(prefix):
+            return compression
+
+    return None
+
+
+def _read_blocks(f, block_size=STREAM_BLOCK_SIZE, prefetch=2):
+    """
+    Yield the blocks of a binary file object, read ahead by a thread so that decompression overlaps parsing
+
+    The thread stops once the generator is closed, which should happen before f is.
+    """
+    blocks = queue.Queue(prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # Wait for room in the queue, unless the consumer stopped
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+
+            except queue.Full:
+                pass
+
+        return False
+
+    def reader():
+        try:
+            for block in iter(lambda: f.read(block_size), b''):
+                if not put(block):
+                    return
+            put(None)
+
+        except Exception as error:
+            put(error)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise block
+            yield block
+
+    finally:
+        stop.set()
+        thread.join()
+
+
+class Profiler:
+    """
+    Per-stage wall time, CPU time and peak memory of a Log, plus per-field line counts and times
+
+    A disabled profiler costs nothing: its stages are null contexts and wrap() returns the functions
+    as is. Peak memory is measured by tracemalloc, which slows the profiled stages down; stages are
+    not meant to be nested.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = OrderedDict()  # Stage name -> calls, wall and CPU seconds, peak MB
+        self.counters = OrderedDict()  # Wrapped function name -> calls, seconds
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = (tracemalloc.get_traced_memory()[1] - current) / 1024 ** 2
+            if started:
+                tracemalloc.stop()
+
+            stage = self.stages.setdefault(name, OrderedDict([('calls', 0), ('wall_s', 0.), ('cpu_s', 0.),
+                                                              ('peak_mb', 0.)]))
+            stage['calls'] += 1
+            stage['wall_s'] += wall
+            stage['cpu_s'] += cpu
+            stage['peak_mb'] = max(stage['peak_mb'], peak)
+
+    def stage(self, name):
+        """
+        Context measuring a stage, accumulated over its calls
+
+        :param name: stage name
+        """
+        return self._stage(name) if self.enabled else contextlib.nullcontext()
+
+    def wrap(self, name, function):
+        """
+        Count the calls of a function and time them
+
+        :param name: counter name, shared by the functions wrapped under the same name
+        :param function: function to wrap
+        :return: wrapped function, or function itself if disabled
+        """
+        if not self.enabled:
+            return function
+
+        counter = self.counters.setdefault(name, [0, 0.])
+
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                counter[0] += 1
+                counter[1] += time.perf_counter() - start
+
+        return timed
+
+    def metrics(self):
+        """
+        Collected metrics, as plain JSON-serializable data
+
+        :return: dict of stages, counters and the process peak RSS in MB
+        """
+        return OrderedDict([('stages', OrderedDict((name, dict(stage)) for name, stage in self.stages.items())),
+                            ('counters', OrderedDict((name, {'calls': calls, 'seconds': seconds})
+                                                     for name, (calls, seconds) in self.counters.items())),
+                            ('peak_rss_mb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)])
+
+    def report(self):
+        """Metrics as a printable text table"""
+        lines = ["%-24s %8s %10s %10s %10s" % ("stage", "calls", "wall (s)", "cpu (s)", "peak (MB)")]
+        lines += ["%-24s %8d %10.3f %10.3f %10.1f" % (name, stage['calls'], stage['wall_s'], stage['cpu_s'],
+                                                      stage['peak_mb']) for name, stage in self.stages.items()]
+        if self.counters:
+            lines += ["", "%-24s %8s %10s" % ("field", "lines", "time (s)")]
+            lines += ["%-24s %8d %10.3f" % (name, calls, seconds) for name, (calls, seconds) in self.counters.items()]
+        lines += ["", "peak RSS: %.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)]
+        return '\n'.join(lines)
+
+
+class PairsDecoder:
+    """
+    Safe decoder for the key/value payloads of MAQT logs
+
+    Payloads are either dicts {'DUST': 0.1, ...} or lists of pairs [('DUST', 0.1), ...].
+    They are decoded without eval(): the first record is tokenized to learn the keys and
+    their sorted order, which is then compiled into a record regex so that the following
+    records only have their numbers converted.
+    """
+
+    _regex_pair = re.compile(r"""(['"])(.*?)\1\s*[,:]\s*([^\s,)}\]]+)""")
+    _regex_number = r"([^\s,)}\]]+)"
+
+    def __init__(self):
+        self.keys = None  # Keys in sorted order
+        self._order = None  # Position in the record of each sorted key
+        self._regex_record = None
+
+    def decode(self, payload):
+        """
+        Decode a payload into its keys and float values, both sorted by key
+
+        :param payload: dict or list of pairs literal
+        :return: keys, values
+        """
+        if self._regex_record is not None:
+            match = self._regex_record.match(payload)
+            if match is not None:
+                values = match.groups()
+                return self.keys, [float(values[i]) for i in self._order]
+
+        pairs = self._regex_pair.findall(payload)
+        if not pairs:
+            raise ValueError("not a key/value payload: %s" % payload.strip())
+
+        keys = [key for _, key, _ in pairs]
+        self._order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in self._order]
+        self._regex_record = re.compile(r"\s*[\[{]\s*"
+                                        + r"\s*,\s*".join(r"\(?\s*['\"]%s['\"]\s*[,:]\s*%s\s*\)?"
+                                                          % (re.escape(key), self._regex_number) for key in keys)
+                                        + r"\s*,?\s*[\]}]\s*$")
+
+        return self.keys, [float(pairs[i][2]) for i in self._order]
+
+
+def _props_array(rows, models):
+    """(dates x models) array viewing the flat rows buffer of aerosol models proportion, or None if empty"""
+    if not len(rows):
+        return None
+
+    return np.frombuffer(rows, dtype=np.float64).reshape(-1, len(models))
+
+
+def _grow(buffer, n_rows):
+    """Buffer with room for n_rows rows, doubling its capacity, or buffer itself if large enough"""
+    if len(buffer) >= n_rows:
+        return buffer
+
+    grown = np.empty((max(n_rows, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+def _yyyymmdd_to_datetime64(dates):
+    """
+    Vectorized conversion of YYYYMMDD integers (or numeric strings) to datetime64[D]
+
+    :param dates: sequence of dates
+    :return: datetime64[D] array
+    """
+    dates = np.asarray(dates).astype(np.int64)
+    years, months, days = dates // 10000, dates // 100 % 100, dates % 100
+    converted = (years - 1970).astype('M8[Y]').astype('M8[M]') + (months - 1).astype('m8[M]')
+    converted = converted.astype('M8[D]') + (days - 1).astype('m8[D]')
+
+    # Out of range months or days would roll over to another date
+    month_starts = converted.astype('M8[M]').astype('M8[D]')
+    invalid = (months < 1) | (months > 12) | (days < 1) | (converted - month_starts != (days - 1).astype('m8[D]'))
+    if invalid.any():
+        raise ValueError("invalid YYYYMMDD date(s): %s" % dates[invalid][:5].tolist())
+
+    return converted
+
+
+class MaqtParser:
+    """
+    Single-pass parser for MAQT log lines
+
+    Each line is classified once against a single compiled alternation of all field
+    regexes, then routed to the matching extractor through a dispatch table. A line
+    carries one field at most: the leftmost marker found wins, the first field of the
+    regex table on ties. Text lines and bytes scans follow this same rule.
+
+    Only the fields of regex_table are parsed. With a date window, the lines of the records
+    dated outside of it are not decoded at all.
+    """
+
+    # Column attribute of each field
+    _field_columns = OrderedDict([('date', 'date_list'), ('rh', 'rh_list'), ('cams_ratio', 'props_rows'),
+                                  ('cloud_fraction', 'cloud_list'), ('cirrus_fraction', 'cirrus_list'),
+                                  ('ozone', 'ozone_list'), ('weight_prev_cams_date', 'weight_prev_cams_date_list'),
+                                  ('weight_next_cams_date', 'weight_next_cams_date_list'),
+                                  ('prev_aot', 'prev_aot_list'), ('next_aot', 'next_aot_list')])
+
+    def __init__(self, regex_table, profiler=None, date_window=None):
+        """
+        :param regex_table: field name -> regex, of the fields to parse
+        :param profiler: Profiler counting the lines of each field, or None
+        :param date_window: (first, last) YYYYMMDD integers of the records to parse, both included, or None
+        """
+        dispatch = '|'.join('(?P<%s>%s)' % (field, regex) for field, regex in regex_table.items())
+        self._regex_dispatch = re.compile(dispatch)
+
+        # Bytes scanning searches the markers one by one, as a lone literal pattern benefits from the
+        # regex engine fast search where the alternation does not. Line anchors become newlines
+        self._regex_markers_bytes = OrderedDict((field, re.compile(b'\n' + regex[1:].encode() if regex.startswith('^')
+                                                                   else regex.encode()))
+                                                for field, regex in regex_table.items())
+        self._extractors = {'date': self._extract_date,
+                            'rh': self._extract_rh,
+                            'cams_ratio': self._extract_cams_ratio,
+                            'cloud_fraction': self._extract_cloud_fraction,
+                            'cirrus_fraction': self._extract_cirrus_fraction,
+                            'ozone': self._extract_ozone,
+                            'weight_prev_cams_date': self._extract_weight_prev_cams_date,
+                            'weight_next_cams_date': self._extract_weight_next_cams_date,
+                            'prev_aot': self._extract_prev_aot,
+                            'next_aot': self._extract_next_aot}
+        self._props_decoder = PairsDecoder()
+        self._prev_aot_decoder = PairsDecoder()
+        self._next_aot_decoder = PairsDecoder()
+
+        # Count and time the lines of each field, and the payloads decoding within them
+        if profiler is not None and profiler.enabled:
+            self._extractors = {field: profiler.wrap(field, extract) for field, extract in self._extractors.items()}
+            for decoder in (self._props_decoder, self._prev_aot_decoder, self._next_aot_decoder):
+                decoder.decode = profiler.wrap('pairs decoding', decoder.decode)
+
+        # Columns are typed arrays, wrapped by NumPy without copy once parsing is over
+        self.date_list = array('q')  # L1C products dates, as YYYYMMDD integers
+        self.rh_list = array('d')  # Average relative humidity
+        self.props_rows = array('d')  # Aerosol models proportion, row after row
+        self.props_list = []  # List of aerosol models
+        self.cloud_list = array('d')  # Cloud fraction with shadow
+        self.cirrus_list = array('d')  # Cirrus fraction
+        self.ozone_list = array('d')  # Ozone TODO: define unit
+        self.weight_prev_cams_date_list = array('d')
+        self.weight_next_cams_date_list = array('d')
+        self.prev_aot_list = array('d')
+        self.next_aot_list = array('d')
+
+        # Columns of the parsed fields, and whether the current record is out of the date window. Lines
+        # before the first date belong to no record, they are skipped with a window
+        self._parsed_columns = [column for field, column in self._field_columns.items() if field in regex_table]
+        self._date_window = date_window
+        self._skip = date_window is not None
+        if date_window is not None:
+            self.feed = self._feed_window
+
+    # Column attributes, in the order of the records
+    _column_names = ('date_list', 'rh_list', 'props_rows', 'cloud_list', 'cirrus_list', 'ozone_list',
+                     'weight_prev_cams_date_list', 'weight_next_cams_date_list', 'prev_aot_list', 'next_aot_list')
+
+    @property
+    def props_arr(self):
+        """Array of aerosol models proportion, (dates x models), viewing the parsed rows without copy"""
+        return _props_array(self.props_rows, self.props_list)
+
+    def get_columns(self):
+        """
+        Parsed columns as plain lists, e.g. to be sent back from a worker process
+
+        :return: dict of column name -> list, plus the aerosol models list
+        """
+        columns = {name: getattr(self, name) for name in self._column_names}
+        columns['props_list'] = self.props_list
+        return columns
+
+    def pop_records(self):
+        """
+        Remove and return the complete records parsed so far
+
+        Fields of a record still being written, found in some columns only, are kept for the next call.
+
+        :return: columns, as returned by get_columns, of the complete records
+        """
+        # Aerosol models proportion rows are flattened in props_rows. Columns of unparsed fields stay empty
+        widths = {name: len(self.props_list) if name == 'props_rows' else 1 for name in self._column_names}
+        n = min(len(getattr(self, name)) // max(widths[name], 1) for name in self._parsed_columns)
+        columns = {'props_list': self.props_list}
+        for name in self._column_names:
+            column = getattr(self, name)
+            columns[name] = column[:n * widths[name]]
+            del column[:n * widths[name]]
+
+        return columns
+
+    def merge(self, columns):
+        """
+        Append the columns parsed on the following part of the log
+
+        Columns are extended one by one, so a record whose fields straddle two parts ends up aligned.
+
+        :param columns: columns, as returned by get_columns
+        """
+        for name in self._column_names:
+            getattr(self, name).extend(columns[name])
+        if not self.props_list:
+            self.props_list = columns['props_list']
+
+    def feed(self, line):
+        match = self._regex_dispatch.search(line)
+        if match is not None:
+            self._extractors[match.lastgroup](line)
+
+    def _feed_window(self, line):
+        # feed() with a date window: a date line starts a record, whose lines are skipped if out of the window
+        match = self._regex_dispatch.search(line)
+        if match is None:
+            return
+
+        field = match.lastgroup
+        if field == 'date':
+            first, last = self._date_window
+            self._skip = not first <= int(line[10:18]) <= last
+        if not self._skip:
+            self._extractors[field](line)
+
+    def _window_ranges(self, buffer, start, end):
+        # Byte ranges of the records within the window, each one from the newline ending the line before, the
+        # leading lines belonging to the record in progress
+        first, last = self._date_window
+        ranges = []
+        range_start = None if self._skip else start
+        for match in self._regex_markers_bytes['date'].finditer(buffer, start, end):
+            line_start = match.start() + 1
+            within = first <= int(buffer[line_start + 10:line_start + 18]) <= last
+            if within and range_start is None:
+                range_start = match.start()
+            elif not within and range_start is not None:
+                ranges.append((range_start, match.start()))
+                range_start = None
+
+        self._skip = range_start is None
+        if range_start is not None:
+            ranges.append((range_start, end))
+
+        return ranges
+
+    def scan(self, buffer, start=0, end=None):
+        """
+        Parse a bytes buffer, e.g. a mmap of the log file, or a part of it
+
+        Markers are searched directly in the bytes, field after field, and only the matching
+        lines are decoded, once each. A decoded line is extracted by the field feed() would
+        route it to, so that a line holding several markers ends up in a single column.
+        With a date window, the dates are searched first, and the other fields in the byte
+        ranges of the records within the window only.
+
+        :param buffer: bytes-like log content
+        :param start: offset of the first line to parse
+        :param end: offset just after the last line to parse, the end of the buffer if None
+        """
+        if end is None:
+            end = len(buffer)
+
+        # The first line has no leading newline for the anchored markers to match
+        first_end = buffer.find(b'\n', start, end)
+        if first_end < 0:
+            first_end = end
+        self.feed(buffer[start:first_end].decode().rstrip('\r') + '\n')
+
+        if self._date_window is None:
+            ranges = [(first_end, end)]
+        else:
+            ranges = self._window_ranges(buffer, first_end, end)
+
+        # Lines hit by each field, known by their end. A line holding the marker twice is a single hit
+        fields = list(self._regex_markers_bytes)
+        hits = array('q')
+        add_hit = hits.append
+        counts = []
+        for field in fields:
+            finditer = self._regex_markers_bytes[field].finditer
+            for range_start, range_end in ranges:
+                line_end = -1
+                for match in finditer(buffer, range_start, range_end):
+                    if match.start() < line_end:
+                        continue
+                    line_end = buffer.find(b'\n', match.end(), end)
+                    if line_end < 0:
+                        line_end = end
+                    add_hit(line_end)
+            counts.append(len(hits) - sum(counts))
+
+        # A line hit by several fields goes to the one feed() would route it to. Lines are then extracted
+        # field after field, in the order of the log
+        ends = np.frombuffer(hits, dtype=np.int64)
+        ranks = np.repeat(np.arange(len(fields)), counts)
+        kept = np.ones(len(ends), dtype=bool)
+        order = np.argsort(ends, kind='stable')
+        shared = np.flatnonzero(ends[order[1:]] == ends[order[:-1]])
+        for i in np.unique(np.concatenate((order[shared], order[shared + 1]))).tolist():
+            end = int(ends[i])
+            line = buffer[buffer.rfind(b'\n', 0, end) + 1:end].decode().rstrip('\r') + '\n'
+            kept[i] = self._regex_dispatch.search(line).lastgroup == fields[ranks[i]]
+
+        extractors = [self._extractors[field] for field in fields]
+        for end, rank in zip(ends[kept].tolist(), ranks[kept].tolist()):
+            extractors[rank](buffer[buffer.rfind(b'\n', 0, end) + 1:end].decode().rstrip('\r') + '\n')
+
+    def _extract_date(self, line):
+        self.date_list.append(int(line[10:18]))
+
+    def _extract_rh(self, line):
+        self.rh_list.append(float(line.split(':')[1]))
+
+    def _extract_cams_ratio(self, line):
+        models, props = self._props_decoder.decode(line.split(':', 1)[1])
+        if not self.props_list:
+            self.props_list = models
+        elif models != self.props_list:
+            raise ValueError("aerosol models changed from %s to %s" % (self.props_list, models))
+        self.props_rows.extend(props)
+
+    def _extract_cloud_fraction(self, line):
+        self.cloud_list.append(float(line.split(':')[2].strip('%\n')) / 100)
+
+    def _extract_cirrus_fraction(self, line):
+        self.cirrus_list.append(Log._extract_float_from_text(line, 14, upto=True))
+
+    def _extract_ozone(self, line):
+        self.ozone_list.append(Log._extract_float_from_text(line, 1, '='))
+
+    def _extract_weight_prev_cams_date(self, line):
+        self.weight_prev_cams_date_list.append(Log._extract_float_from_text(line, 1, ':'))
+
+    def _extract_weight_next_cams_date(self, line):
+        self.weight_next_cams_date_list.append(Log._extract_float_from_text(line, 1, ':'))
+
+    def _extract_prev_aot(self, line):
+        self.prev_aot_list.append(sum(self._prev_aot_decoder.decode(line.split(':', 1)[1])[1]))
+
+    def _extract_next_aot(self, line):
+        self.next_aot_list.append(sum(self._next_aot_decoder.decode(line.split(':', 1)[1])[1]))
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed log columns, one .npz file per log
+
+    Entries are named after the log absolute path and are valid as long as the log size, mtime and
+    the hash of its first and last MB are unchanged, and as long as they were written by a parser of
+    the same version. Least recently used entries are evicted once the cache grows over max_bytes.
+    """
+
+    # Version of the parsing results, to be bumped whenever a change of the parser changes them: entries of
+    # other versions are parsed again. 2: lines holding several markers go to a single field
+    version = 2
+
+    # Column names, in the order of Log._parse_maqt_log outputs
+    _column_names = ('date_list', 'rh_list', 'props_arr', 'props_list', 'cloud_list', 'cirrus_list', 'ozone_list',
+                     'weight_prev_cams_date_list', 'weight_next_cams_date_list', 'prev_aot_list', 'next_aot_list')
+    _digest_span = 1024 ** 2
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def load(self, filename):
+        """
+        Load the parsed columns of a log, if cached and still valid
+
+        :param filename: MAQT log file
+        :return: columns tuple, or None
+        """
+        entry = self._entry(filename)
+        try:
+            stat = os.stat(filename)
+            with np.load(entry, allow_pickle=False) as cached:
+                if int(cached['version']) != self.version or int(cached['size']) != stat.st_size \
+                        or int(cached['mtime_ns']) != stat.st_mtime_ns \
+                        or str(cached['digest']) != self._digest(filename, stat.st_size):
+                    return None
+                columns = tuple(cached[name].tolist() if name == 'props_list' else cached[name]
+                                for name in self._column_names)
+
+        except (OSError, KeyError, ValueError):
+            return None
+
+        # Keep track of the use for the LRU eviction, unless another process sharing the cache just evicted it
+        try:
+            os.utime(entry)
+
+        except FileNotFoundError:
+            pass
+
+        return columns
+
+    def store(self, filename, columns):
+        """
+        Cache the parsed columns of a log, then evict the least recently used entries over max_bytes
+
+        :param filename: MAQT log file
+        :param columns: columns tuple, as returned by Log._parse_maqt_log
+        """
+        stat = os.stat(filename)
+        arrays = {name: np.asarray(column) for name, column in zip(self._column_names, columns)}
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            np.savez(f, version=self.version, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                     digest=self._digest(filename, stat.st_size), **arrays)
+        os.replace(f.name, self._entry(filename))
+
+        self._evict()
+
+    def _entry(self, filename):
+        return os.path.join(self.directory, hashlib.sha1(os.path.abspath(filename).encode()).hexdigest() + '.npz')
+
+    def _digest(self, filename, size):
+        digest = hashlib.blake2b()
+        with open(filename, 'rb') as f:
+            digest.update(f.read(self._digest_span))
+            if size > self._digest_span:
+                f.seek(max(size - self._digest_span, self._digest_span))
+                digest.update(f.read())
+
+        return digest.hexdigest()
+
+    def _evict(self):
+        # Processes sharing the cache may evict the same entries at the same time
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+
+                except FileNotFoundError:
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+
+            except FileNotFoundError:
+                pass
+
+            total -= size
+
+
+class LogIndex:
+    """
+    Sidecar index of a log, mapping the L1C date of each record to the byte range of its lines
+
+    The index is stored next to the log as <log>.idx, built by a single bytes scan for the date lines, and
+    rebuilt once the log size, mtime or the hash of its last 64 kB changed. Compressed logs cannot be
+    seeked into, they are not indexed.
+    """
+
+    _digest_span = 64 * 1024
+
+    def __init__(self, marker=b'L1C', suffix='.idx'):
+        self.marker = marker
+        self.suffix = suffix
+        self._regex_marker = re.compile(b'\n' + re.escape(marker))
+
+    def load(self, filename):
+        """
+        Load the index of a log, if built and still valid
+
+        :param filename: MAQT log file
+        :return: dates (YYYYMMDD integers), record start offsets and log size, or None
+        """
+        try:
+            stat = os.stat(filename)
+            with open(filename + self.suffix, 'rb') as f, np.load(f, allow_pickle=False) as index:
+                if int(index['size']) != stat.st_size or int(index['mtime_ns']) != stat.st_mtime_ns \
+                        or str(index['digest']) != self._digest(filename, stat.st_size):
+                    return None
+                return index['dates'], index['starts'], stat.st_size
+
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def build(self, filename, verbose=False):
+        """
+        Index the records of a log, and store the index next to it if its directory is writable
+
+        :param filename: MAQT log file
+        :param verbose: print the number of indexed records
+        :return: dates (YYYYMMDD integers), record start offsets and log size
+        """
+        stat = os.stat(filename)
+        dates, starts = array('q'), array('q')
+        if stat.st_size:
+            with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if buffer[:len(self.marker)] == self.marker:
+                    dates.append(int(buffer[10:18]))
+                    starts.append(0)
+                for match in self._regex_marker.finditer(buffer):
+                    start = match.start() + 1
+                    dates.append(int(buffer[start + 10:start + 18]))
+                    starts.append(start)
+
+        dates, starts = np.frombuffer(dates, dtype=np.int64), np.frombuffer(starts, dtype=np.int64)
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp',
+                                             delete=False) as f:
+                np.savez(f, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                         digest=self._digest(filename, stat.st_size), dates=dates, starts=starts)
+            os.replace(f.name, filename + self.suffix)
+
+        except OSError as error:
+            if verbose:
+                print("INFO: cannot store the index of %s: %s" % (filename, error))
+
+        if verbose:
+            print("INFO: indexed %d records of %s" % (len(dates), filename))
+        return dates, starts, stat.st_size
+
+    def ranges(self, filename, first=0, last=99999999, verbose=False):
+        """
+        Byte ranges of the records dated from first to last, both included, building the index if needed
+
+        Adjacent records are merged into a single range.
+
+        :param filename: MAQT log file
+        :param first: first date, as YYYYMMDD integer
+        :param last: last date, as YYYYMMDD integer
+        :param verbose: print the index building
+        :return: list of (start, end) byte offsets
+        """
+        index = self.load(filename)
+        if index is None:
+            index = self.build(filename, verbose)
+        dates, starts, size = index
+
+        ends = np.append(starts[1:], size)
+        within = np.flatnonzero((dates >= first) & (dates <= last))
+        if not len(within):
+            return []
+
+        # Records i and i + 1 both selected make a single range
+        breaks = np.flatnonzero(np.diff(within) != 1)
+        range_starts = within[np.concatenate(([0], breaks + 1))]
+        range_ends = within[np.concatenate((breaks, [len(within) - 1]))]
+        return list(zip(starts[range_starts].tolist(), ends[range_ends].tolist()))
+
+    def _digest(self, filename, size):
+        with open(filename, 'rb') as f:
+            f.seek(max(size - self._digest_span, 0))
+            return hashlib.blake2b(f.read()).hexdigest()
+
+
+def interpolate_total_aot(weight_prev, prev_aot, weight_next, next_aot):
+    """
+    Total CAMS AOT, time-interpolated between the previous and next CAMS dates
+
+    :param weight_prev: previous CAMS date weights
+    :param prev_aot: previous CAMS date AOT
+    :param weight_next: next CAMS date weights
+    :param next_aot: next CAMS date AOT
+    :return: total AOT array
+    """
+    return np.asarray(weight_prev) * np.asarray(prev_aot) + np.asarray(weight_next) * np.asarray(next_aot)
+
+
+def aerosol_stack(props_arr, total_aot=None):
+    """
+    Heights and bottoms of the stacked aerosol bars, computed on the whole (dates x models) matrix at once
+
+    :param props_arr: aerosol models proportion, (dates x models)
+    :param total_aot: total AOT per date, to get the tau-weighted AOT of each model, or None for proportions
+    :return: heights, bottoms, both (dates x models)
+    """
+    heights = props_arr if total_aot is None else props_arr * np.asarray(total_aot)[:, np.newaxis]
+    bottoms = np.zeros_like(heights)
+    np.cumsum(heights[:, :-1], axis=1, out=bottoms[:, 1:])
+
+    return heights, bottoms
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling
+
+    :param x: sorted abscissa
+    :param y: ordinates
+    :param n_out: number of points to keep
+    :return: sorted indices array
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # First and last points are kept, the others are split into n_out - 2 buckets
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.int64), n)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    for i in range(n_out - 2):
+        start, end, next_end = edges[i], edges[i + 1], edges[i + 2]
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        prev_x, prev_y = x[selected[i]], y[selected[i]]
+
+        # Keep the point making the largest triangle with the previous kept point and the next bucket average
+        areas = np.abs((prev_x - next_x) * (y[start:end] - prev_y) - (prev_x - x[start:end]) * (next_y - prev_y))
+        selected[i + 1] = start + np.argmax(areas)
+
+    return selected
+
+
+def resample_frame(frame, bins, method='mean', date_column='Date', key_column=None):
+    """
+    Downsample a date-sorted frame to bins rows at most
+
+    'mean' and 'max' aggregate the rows over bins of equal duration, dated by the mean date of their rows.
+    'lttb' keeps the rows selected by Largest-Triangle-Three-Buckets on key_column.
+
+    :param frame: DataFrame with a date column
+    :param bins: target number of rows
+    :param method: one of RESAMPLE_METHODS
+    :param date_column: name of the date column
+    :param key_column: column driving the 'lttb' selection
+    :return: resampled DataFrame
+    """
+    if len(frame) <= bins:
+        return frame
+
+    dates = frame[date_column].to_numpy()
+    if method == 'lttb':
+        return frame.iloc[lttb_indices(dates.astype(np.int64), frame[key_column].to_numpy(), bins)]
+
+    elapsed = (dates - dates[0]).astype(np.float64)
+    span = elapsed[-1] if elapsed[-1] > 0 else 1
+    groups = np.minimum((elapsed / span * bins).astype(np.int64), bins - 1)
+
+    grouped = frame.groupby(groups, sort=True)
+    resampled = grouped.agg(method)
+    resampled[date_column] = grouped[date_column].mean()
+    return resampled.reset_index(drop=True)
+
+
+def _new_figure():
+    """
+    Figure on its own Agg canvas, independent of pylab's current figure
+
+    matplotlib is imported on first use only, so that table-only runs never load it.
+
+    :return: figure and its single axes
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from pandas.plotting import register_matplotlib_converters
+
+    register_matplotlib_converters()
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def render_plots(logs, workers=1, steps=None, resample=None, bins=RESAMPLE_BINS, executor=None):
+    """
+    Save the plots of several logs, rendering their figures over a pool of worker processes
+
+    :param logs: Log instances
+    :param workers: number of worker processes, when no executor is given
+    :param steps: draw step areas, or None to do so above STEP_PLOT_THRESHOLD dates
+    :param resample: downsample the series to bins dates with one of RESAMPLE_METHODS, or None
+    :param bins: number of dates of resampled series
+    :param executor: process pool shared across calls, instead of one per call
+    :return: PNG file names, in the order of logs
+    """
+    figures = [figure for log in logs for figure in log.figures(steps, resample, bins)]
+    if executor is None and workers <= 1:
+        return [render(**kwargs) for render, kwargs in figures]
+
+    pool = executor or concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(render, **kwargs) for render, kwargs in figures]
+        return [future.result() for future in futures]
+
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+
+def _parse_maqt_chunk(filename, start, end, regex_table, date_window=None):
+    """Parse the [start, end) byte range of a log, in a worker process of Log._parse_maqt_log_parallel"""
+    parser = MaqtParser(regex_table, date_window=date_window)
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        parser.scan(f.read(end - start))
+
+    return parser.get_columns()
 
 
 class Log:
-    def __init__(self, log_file, tau_weight=False, verbose=False):
+    def __init__(self, log_file, tau_weight=False, verbose=False, keep_raw=False, mmap_threshold=MMAP_THRESHOLD,
+                 jobs=1, cache=None, follow=False, profile=False, fields=None, date_from=None, date_to=None,
+                 index=None):
 
         # Catch args as attributes
         self._weight_by_tau = tau_weight
         self.verbose = verbose
 
+        # Per-stage metrics, measured only if profiling
+        self.profiler = Profiler(profile)
+
         # DataFrame key labels
         self.lbl_date = 'Date'
         self.lbl_rh = 'RH'
@@ -69,46 +1058,299 @@ class Log:
         self.regex_maqt_weight_prev_cams_date = "weightPrevCAMSdate"
         self.regex_maqt_weight_next_cams_date = "weightNextCAMSdate"
 
-        # Load log file content
-        self._raw, self._log_file_name = self._get_file_text(log_file, verbose)
+        # Field name -> regex table, compiled once into the parser dispatch alternation
+        self._maqt_regex_table = OrderedDict([('date', self.regex_maqt_date),
+                                              ('rh', self.regex_maqt_rh),
+                                              ('cams_ratio', self.regex_maqt_cams_ratio),
+                                              ('cloud_fraction', self.regex_maqt_cloud_fraction),
+                                              ('cirrus_fraction', self.regex_maqt_cirrus_fraction),
+                                              ('ozone', self.regex_maqt_ozone),
+                                              ('weight_prev_cams_date', self.regex_maqt_weight_prev_cams_date),
+                                              ('weight_next_cams_date', self.regex_maqt_weight_next_cams_date),
+                                              ('prev_aot', self.regex_maqt_prev_aot),
+                                              ('next_aot', self.regex_maqt_next_aot)])
+
+        # Fields and date window pushed down to the parser. The cache holds whole logs, it is bypassed then,
+        # and when profiling, for the parse to be measured rather than a cache load
+        self._set_pushdown(fields, date_from, date_to)
+        if self._pushdown or profile:
+            cache = None
+
+        # Sidecar index, to seek straight to the records of the date window
+        self._index = index
 
-        # Parse MAQT log file
+        # Byte offset and parser state kept in follow mode, for refresh() to parse the appended lines only
+        self._log_file = log_file
+        self._offset = 0
+        self._tail_parser = self._new_parser() if follow else None
+
+        # Load and parse MAQT log file, unless its columns are found in the parse cache
         # todo: test log file for MAQT or MAJA type
+        with self.profiler.stage('read and parse'):
+            columns = self._load_columns(log_file, keep_raw, mmap_threshold, jobs, cache, follow, verbose)
+
         self._date_list, self._rh_list, self._props_arr, self._props_list, self._cloud_list, self._cirrus_list, self._ozone_list, \
-        self._weight_prev_cams_date_list, self._weight_next_cams_date_list, self._prev_aot_list, self._next_aot_list = self._parse_maqt_log()
+        self._weight_prev_cams_date_list, self._weight_next_cams_date_list, self._prev_aot_list, self._next_aot_list = columns
 
         # Compute interpolated total AOT
-        self._total_AOT_list = self._interpolate_total_aot()
+        with self.profiler.stage('total AOT'):
+            self._total_AOT_list = self._interpolate_total_aot(*columns[7:])
 
         # Building an attribute df of type DataFrame
-        self.df = self._building_maqt_dataframe()
+        self._check_records(log_file, follow)
+        with self.profiler.stage('DataFrame build'):
+            self.df = self._building_maqt_dataframe(columns, self._total_AOT_list)
+
+        # Stacked aerosol bars, tau-weighted or not, and resampled plot frames
+        with self.profiler.stage('aerosol stack'):
+            self._aerosol_heights, self._aerosol_bottoms = self._compute_aerosol_stack(self._props_arr,
+                                                                                       self._total_AOT_list)
+        self._resampled = {}
+
+        # Sorted dates and the df row of each, built on the first date query
+        self._date_index = None
+
+        # Follow mode buffers of the df columns, aerosol stack, dates and aerosol models proportion, built on
+        # the first refresh, and columns of the saved table, for new records to be appended to it
+        self._buffers = None
+        self._stack_buffers = None
+        self._date_buffer = None
+        self._props_buffer = None
+        self._table_columns = None
 
         if verbose:
             pd.set_option('display.expand_frame_repr', False)
-            print(self.df.describe())
+            with self.profiler.stage('describe'):
+                description = self.df.describe()
+            print(description)
 
-    def _building_maqt_dataframe(self):
-        try:
-            df = pd.DataFrame(data={self.lbl_date: self._date_list,
-                                    self.lbl_rh: self._rh_list,
-                                    self.lbl_cloud: self._cloud_list,
-                                    self.lbl_cirrus: self._cirrus_list,
-                                    self.lbl_ozone: self._ozone_list,
-                                    self.lbl_weight_prev_cams_date: self._weight_prev_cams_date_list,
-                                    self.lbl_weight_next_cams_date: self._weight_next_cams_date_list,
-                                    self.lbl_prev_aot: self._prev_aot_list,
-                                    self.lbl_next_aot: self._next_aot_list,
-                                    self.lbl_total_aot: self._total_AOT_list})
-
-            props_df = pd.DataFrame(self._props_arr, columns=self._props_list)
-            df = pd.concat([df, props_df], axis=1)
-            return df
+    def _set_pushdown(self, fields=None, date_from=None, date_to=None):
+        if fields is not None:
+            unknown = set(fields) - set(MAQT_FIELDS)
+            if unknown:
+                raise ValueError("unknown field(s) %s, expected some of %s" % (sorted(unknown), MAQT_FIELDS))
+
+            # Tau-weighted aerosols need the total AOT
+            fields = set(fields)
+            if self._weight_by_tau and 'cams_ratio' in fields:
+                fields.update(('weight_prev_cams_date', 'weight_next_cams_date', 'prev_aot', 'next_aot'))
+            self._maqt_regex_table = OrderedDict((field, regex) for field, regex in self._maqt_regex_table.items()
+                                                 if field == 'date' or field in fields)
+
+        if date_from is None and date_to is None:
+            self._date_window = None
+        else:
+            self._date_window = (0 if date_from is None else int(pd.Timestamp(date_from).strftime('%Y%m%d')),
+                                 99999999 if date_to is None else int(pd.Timestamp(date_to).strftime('%Y%m%d')))
+
+        self._pushdown = fields is not None or self._date_window is not None
+
+    def _new_parser(self):
+        return MaqtParser(self._maqt_regex_table, self.profiler, self._date_window)
+
+    def _parsed(self, *fields):
+        return all(field in self._maqt_regex_table for field in fields)
+
+    def _load_columns(self, log_file, keep_raw, mmap_threshold, jobs, cache, follow, verbose):
+        if keep_raw:
+            self._raw, self._log_file_name = self._get_file_text(log_file, verbose)
+            columns = self._parse_maqt_log(self._raw)
+        else:
+            self._raw = None
+            self._log_file_name = self._get_log_name(log_file)
+            columns = cache.load(log_file) if cache is not None and not follow else None
+            if columns is not None:
+                if verbose:
+                    print("INFO: loaded %s from cache" % log_file)
+            elif follow:
+                if detect_compression(log_file) is not None:
+                    print("ERROR: cannot follow compressed file %s..." % log_file)
+                    sys.exit(1)
+                columns = self._parse_appended()
+            else:
+                columns = self._parse_maqt_file(log_file, jobs, mmap_threshold, verbose)
+                if cache is not None and columns[2] is not None:
+                    cache.store(log_file, columns)
+
+        return columns
+
+    def metrics(self):
+        """
+        Metrics collected while profiling: per-stage wall time, CPU time and peak memory, and per-field
+        line counts and times. Fields parsed in worker processes (jobs > 1) are not counted
+
+        :return: dict, empty if the Log was built without profile
+        """
+        if not self.profiler.enabled:
+            return {}
+
+        metrics = self.profiler.metrics()
+        metrics['log'] = self._log_file
+        metrics['records'] = len(self.df)
+        return metrics
+
+    def metrics_json(self, **kwargs):
+        """
+        Metrics as JSON, e.g. for a scheduler to collect
+
+        :param kwargs: json.dumps arguments, e.g. indent
+        :return: JSON string of metrics()
+        """
+        return json.dumps(self.metrics(), **kwargs)
+
+    def _sorted_dates(self):
+        # A log written in chronological order needs no permutation, its df rows are the sorted ones
+        if self._date_index is None:
+            dates = self.df[self.lbl_date].to_numpy()
+            if self.df[self.lbl_date].is_monotonic_increasing:
+                self._date_index = dates, None
+            else:
+                order = np.argsort(dates, kind='stable')
+                self._date_index = dates[order], order
+
+        return self._date_index
+
+    def _rows(self, lo, hi):
+        # df rows of the sorted dates [lo, hi), as a slice when the log is sorted
+        order = self._sorted_dates()[1]
+        return slice(lo, hi) if order is None else order[lo:hi]
 
-        except UnboundLocalError:
+    def _date_bounds(self, start=None, end=None):
+        dates = self._sorted_dates()[0]
+        lo = 0 if start is None else dates.searchsorted(np.datetime64(pd.Timestamp(start)), side='left')
+        hi = len(dates) if end is None else dates.searchsorted(np.datetime64(pd.Timestamp(end)), side='right')
+        return lo, max(lo, hi)
+
+    def between(self, start=None, end=None):
+        """
+        Records dated from start to end, both included, found by binary search
+
+        :param start: first date, e.g. '2015-07-01', or None from the first record
+        :param end: last date, or None up to the last record
+        :return: DataFrame of the records, in date order
+        """
+        return self.df.iloc[self._rows(*self._date_bounds(start, end))]
+
+    def nearest(self, date):
+        """
+        Record of the date closest to date, the earlier one on ties
+
+        :param date: date, e.g. '2015-07-01'
+        :return: Series of the record, or None if there is no record
+        """
+        dates = self._sorted_dates()[0]
+        if not len(dates):
+            return None
+
+        date = np.datetime64(pd.Timestamp(date))
+        pos = dates.searchsorted(date)
+        if pos == len(dates) or (pos > 0 and date - dates[pos - 1] <= dates[pos] - date):
+            pos -= 1
+
+        return self.df.iloc[self._rows(pos, pos + 1)].iloc[0]
+
+    def asof(self, date):
+        """
+        Last record dated on or before date
+
+        :param date: date, e.g. '2015-07-01'
+        :return: Series of the record, or None if all records are later
+        """
+        pos = self._sorted_dates()[0].searchsorted(np.datetime64(pd.Timestamp(date)), side='right') - 1
+        if pos < 0:
+            return None
+
+        return self.df.iloc[self._rows(pos, pos + 1)].iloc[0]
+
+    def window(self, start=None, end=None):
+        """
+        Log restricted to the records dated from start to end, both included, e.g. to plot or save them
+
+        The records are sliced without copy when the log is in date order.
+
+        :param start: first date, or None from the first record
+        :param end: last date, or None up to the last record
+        :return: Log sharing the parsed data of this one
+        """
+        if start is None and end is None:
+            return self
+
+        rows = self._rows(*self._date_bounds(start, end))
+        view = copy.copy(self)
+        view.df = self.df.iloc[rows]
+        if self._aerosol_heights is not None:
+            view._aerosol_heights = self._aerosol_heights[rows]
+            view._aerosol_bottoms = self._aerosol_bottoms[rows]
+        view._resampled = {}
+        view._date_index = None
+        return view
+
+    def weighted(self, tau_weight=True):
+        """
+        Log whose aerosol stack is weighted by tau or not, e.g. to plot both without parsing the log twice
+
+        :param tau_weight: weight aerosols with tau
+        :return: Log sharing the parsed data of this one, or this one if weighted alike
+        """
+        if tau_weight == self._weight_by_tau:
+            return self
+
+        view = copy.copy(self)
+        view._weight_by_tau = tau_weight
+        view._aerosol_heights, view._aerosol_bottoms = view._compute_aerosol_stack(view._props_arr,
+                                                                                   view._total_AOT_list)
+        view._resampled = {}
+        return view
+
+    def _check_records(self, log_file, follow=False):
+        # No record parsed is an empty frame when out of the date window or with the first record still being
+        # written in follow mode, an error if the log has none at all
+        if self._parsed('cams_ratio'):
+            empty = self._props_arr is None
+        else:
+            empty = not len(self._date_list)
+
+        if empty and not follow and (self._date_window is None or not self._contains_records(log_file)):
             print("ERROR: file %s doesn't seem to contain expected fields..." % self._log_file_name)
             print("       Is it really a log of MAQT?")
             sys.exit(1)
 
+    def _contains_records(self, filename):
+        # A MAQT log starts with its first record, so that the search stops on the first lines
+        regex = re.compile(self.regex_maqt_date)
+        return any(regex.search(line) is not None for line in self._iter_file_lines(filename))
+
+    def _scalar_columns(self):
+        # Parsed field, df label and Log attribute of the columns holding a float per record
+        return (('rh', self.lbl_rh, '_rh_list'),
+                ('cloud_fraction', self.lbl_cloud, '_cloud_list'),
+                ('cirrus_fraction', self.lbl_cirrus, '_cirrus_list'),
+                ('ozone', self.lbl_ozone, '_ozone_list'),
+                ('weight_prev_cams_date', self.lbl_weight_prev_cams_date, '_weight_prev_cams_date_list'),
+                ('weight_next_cams_date', self.lbl_weight_next_cams_date, '_weight_next_cams_date_list'),
+                ('prev_aot', self.lbl_prev_aot, '_prev_aot_list'),
+                ('next_aot', self.lbl_next_aot, '_next_aot_list'))
+
+    def _building_maqt_dataframe(self, columns, total_aot):
+        # Parsed columns are wrapped without copy, dates are converted in a single vectorized pass
+        date_list, rh_list, props_arr, props_list, cloud_list, cirrus_list, ozone_list, \
+        weight_prev_cams_date_list, weight_next_cams_date_list, prev_aot_list, next_aot_list = columns
+        data = OrderedDict([(self.lbl_date, _yyyymmdd_to_datetime64(date_list))])
+        for (field, label, _), column in zip(self._scalar_columns(),
+                                             (rh_list, cloud_list, cirrus_list, ozone_list,
+                                              weight_prev_cams_date_list, weight_next_cams_date_list,
+                                              prev_aot_list, next_aot_list)):
+            if self._parsed(field):
+                data[label] = np.asarray(column)
+        if total_aot is not None:
+            data[self.lbl_total_aot] = total_aot
+        df = pd.DataFrame(data=data, copy=False)
+
+        if props_arr is not None:
+            props_df = pd.DataFrame(props_arr, columns=props_list, copy=False)
+            df = pd.concat([df, props_df], axis=1)
+        return df
+
     @staticmethod
     def _extract_float_from_text(text, pos, sep=None, upto=False):
         if sep is not None:
@@ -118,154 +1360,1016 @@ class Log:
             return float(text[pos:])
 
     @staticmethod
-    def _get_file_text(filename, verbose=False):
-        try:
-            with open(filename, 'r') as f:
-                raw = f.readlines()
-                f.close()
-                name = filename.split('/')[-1]
+    def _get_log_name(filename):
+        # Base name of the log, without the suffix of its compression if any
+        name = filename.split('/')[-1]
+        for _, _, suffix in COMPRESSION_FORMATS.values():
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
 
-            if verbose:
-                print("INFO: successfully opened %s" % filename)
+        return name
 
-            return raw, name
+    @staticmethod
+    def _open_file(filename, verbose=False):
+        # Binary file object of the log, decompressing it on the fly if compressed
+        compression = detect_compression(filename)
+        try:
+            if compression is None:
+                f = open(filename, 'rb')
+            else:
+                f = COMPRESSION_FORMATS[compression][1](filename, 'rb')
 
         except FileNotFoundError:
             print("ERROR: file %s not found..." % filename)
             sys.exit(1)
 
-    def _interpolate_total_aot(self):
-        return np.array(self._weight_prev_cams_date_list) \
-               * np.array(self._prev_aot_list) \
-               + np.array(self._weight_next_cams_date_list) \
-               * np.array(self._next_aot_list)
-
-    def _parse_maqt_log(self):
-        date_list = []  # List of L1C products used
-        rh_list = []  # List of average relative humidity
-        props_list = []  # List of aerosol models proportion
-        cloud_list = []  # List of cloud fraction with shadow
-        cirrus_list = []  # List of cirrus fraction
-        ozone_list = []  # List of ozone TODO: define unit
-        weight_prev_cams_date_list = []
-        weight_next_cams_date_list = []
-        prev_aot_list = []
-        next_aot_list = []
-
-        for line in range(len(self._raw)):
-            # Extract list of date
-            if re.search(self.regex_maqt_date, self._raw[line]) is not None:
-                date_list.append(pd.to_datetime(self._raw[line][10:18], format='%Y%m%d'))
-
-            # Extract relative humidity
-            if re.search(self.regex_maqt_rh, self._raw[line]) is not None:
-                rh_list.append(float(self._raw[line].split(':')[1]))
-
-            # Extract models proportion
-            if re.search(self.regex_maqt_cams_ratio, self._raw[line]) is not None:
-                temporal_interp_props = OrderedDict(sorted(eval(self._raw[line].split(':')[1])))
-                if not props_list:
-                    props_arr = np.array(list(temporal_interp_props.values()))
-                    props_list = temporal_interp_props.keys()
-                else:
-                    # props_arr seems referenced before assignment here, but any error will be caught
-                    # by the 'UnboundLocalError' exception handler later on. Anyway, the former if
-                    # clause should 'always' initialize it
-                    props_arr = np.vstack((props_arr, list(temporal_interp_props.values())))
-
-            # Extract cloud fraction
-            if re.search(self.regex_maqt_cloud_fraction, self._raw[line]) is not None:
-                cloud_list.append(float(self._raw[line].split(':')[2].strip('%\n')) / 100)
-
-            # Extract cirrus fraction
-            if re.search(self.regex_maqt_cirrus_fraction, self._raw[line]) is not None:
-                cirrus_list.append(self._extract_float_from_text(self._raw[line], 14, upto=True))
-
-            # Extract ozone
-            if re.search(self.regex_maqt_ozone, self._raw[line]) is not None:
-                ozone_list.append(self._extract_float_from_text(self._raw[line], 1, '='))
-
-            # Extract previous CAMS weights
-            if re.search(self.regex_maqt_weight_prev_cams_date, self._raw[line]) is not None:
-                weight_prev_cams_date_list.append(self._extract_float_from_text(self._raw[line], 1, ':'))
-
-            # Extract previous CAMS weights
-            if re.search(self.regex_maqt_weight_next_cams_date, self._raw[line]) is not None:
-                weight_next_cams_date_list.append(self._extract_float_from_text(self._raw[line], 1, ':'))
-
-            # Extract previous CAMS AOT
-            if re.search(self.regex_maqt_prev_aot, self._raw[line]) is not None:
-                prev_aot_dict = OrderedDict(sorted(eval(self._raw[line].split(':')[1])))
-                prev_aot_list.append(np.array(list(prev_aot_dict.values())).sum())
-
-            # Extract next CAMS AOT
-            if re.search(self.regex_maqt_next_aot, self._raw[line]) is not None:
-                next_aot_dict = OrderedDict(sorted(eval(self._raw[line].split(':')[1])))
-                next_aot_list.append(np.array(list(next_aot_dict.values())).sum())
-
-        return date_list, rh_list, props_arr, props_list, cloud_list, cirrus_list, ozone_list, \
-               weight_prev_cams_date_list, weight_next_cams_date_list, prev_aot_list, next_aot_list
+        except ImportError as error:
+            print("ERROR: cannot open %s: %s" % (filename, error))
+            sys.exit(1)
+
+        if verbose:
+            print("INFO: successfully opened %s%s" % (filename, " (%s)" % compression if compression else ""))
+
+        return f
+
+    @staticmethod
+    def _get_file_text(filename, verbose=False):
+        with io.TextIOWrapper(Log._open_file(filename, verbose)) as f:
+            raw = f.readlines()
+            name = Log._get_log_name(filename)
+
+        return raw, name
+
+    @staticmethod
+    def _iter_file_lines(filename, verbose=False):
+        with io.TextIOWrapper(Log._open_file(filename, verbose)) as f:
+            yield from f
+
+    @staticmethod
+    def _map_file(filename, verbose=False):
+        with open(filename, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if verbose:
+            print("INFO: successfully mapped %s" % filename)
+
+        return buffer
+
+    @staticmethod
+    def _split_file(filename, n_chunks, record_start=None):
+        """Split a file into n_chunks byte ranges at most, each one starting at a line start, or at a line
+        starting with record_start if given"""
+        size = os.path.getsize(filename)
+        bounds = [0]
+        with open(filename, 'rb') as f:
+            for i in range(1, n_chunks):
+                f.seek(max(size * i // n_chunks, bounds[-1]))
+                f.readline()
+                if record_start is not None:
+                    position = f.tell()
+                    line = f.readline()
+                    while line and not line.startswith(record_start):
+                        position = f.tell()
+                        line = f.readline()
+                    f.seek(position)
+                if f.tell() >= size:
+                    break
+                if f.tell() > bounds[-1]:
+                    bounds.append(f.tell())
+        bounds.append(size)
+
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _interpolate_total_aot(self, weight_prev_cams_date_list, weight_next_cams_date_list, prev_aot_list,
+                               next_aot_list):
+        if not self._parsed('weight_prev_cams_date', 'weight_next_cams_date', 'prev_aot', 'next_aot'):
+            return None
+        return interpolate_total_aot(weight_prev_cams_date_list, prev_aot_list, weight_next_cams_date_list,
+                                     next_aot_list)
+
+    def _compute_aerosol_stack(self, props_arr, total_aot):
+        if props_arr is None:
+            return None, None
+        return aerosol_stack(props_arr, total_aot if self._weight_by_tau else None)
+
+    def _parse_maqt_log(self, source):
+        parser = self._new_parser()
+        if isinstance(source, mmap.mmap):
+            with source:
+                parser.scan(source)
+        else:
+            for line in source:
+                parser.feed(line)
+
+        return self._parser_columns(parser)
+
+    def _parse_appended(self):
+        # Scan the complete lines appended since the saved offset in a mmap of the log, block after block, the
+        # pages of each scanned block being released, so that memory stays bounded whatever the size appended.
+        # Returns the complete records only
+        try:
+            if os.path.getsize(self._log_file) > self._offset:
+                with self._map_file(self._log_file) as buffer:
+                    last = buffer.rfind(b'\n', self._offset) + 1
+                    while self._offset < last:
+                        end = buffer.rfind(b'\n', self._offset, min(self._offset + STREAM_BLOCK_SIZE, last)) + 1
+                        if not end:
+                            end = buffer.find(b'\n', self._offset) + 1
+                        self._tail_parser.scan(buffer, self._offset, end)
+                        if hasattr(mmap, 'MADV_DONTNEED'):
+                            page = self._offset - self._offset % mmap.PAGESIZE
+                            buffer.madvise(mmap.MADV_DONTNEED, page, end - page)
+                        self._offset = end
+
+        except FileNotFoundError:
+            print("ERROR: file %s not found..." % self._log_file)
+            sys.exit(1)
+
+        records = self._tail_parser.pop_records()
+        return records['date_list'], records['rh_list'], \
+               _props_array(records['props_rows'], records['props_list']), records['props_list'], \
+               records['cloud_list'], records['cirrus_list'], records['ozone_list'], \
+               records['weight_prev_cams_date_list'], records['weight_next_cams_date_list'], \
+               records['prev_aot_list'], records['next_aot_list']
+
+    def refresh(self):
+        """
+        Parse the lines appended to the log since the last parse, and append the new records to df
+
+        Only available in follow mode. Records still being written are left for the next refresh.
+
+        :return: number of new records
+        """
+        if self._tail_parser is None:
+            raise ValueError("refresh() needs a Log opened with follow=True")
+
+        with self.profiler.stage('refresh'):
+            columns = self._parse_appended()
+            if not len(columns[0]):
+                return 0
+
+            return self._append_columns(columns)
+
+    def _append_columns(self, columns):
+        # New records are copied into buffers of doubling capacity, which df, the aerosol stack and the parsed
+        # columns view without copy, so that a refresh costs the new records only, whatever the number of
+        # records already parsed. Returns the number of new records
+        date_list, props_arr, props_list = columns[0], columns[2], columns[3]
+        total_aot = self._interpolate_total_aot(*columns[7:])
+        new_df = self._building_maqt_dataframe(columns, total_aot)
+        heights, bottoms = self._compute_aerosol_stack(props_arr, total_aot)
+
+        if self._buffers is None:
+            self._buffers = OrderedDict((label, self.df[label].to_numpy()) for label in self.df)
+            self._date_buffer = np.asarray(self._date_list, dtype=np.int64)
+            self._props_buffer = self._props_arr
+            if self._aerosol_heights is not None:
+                self._stack_buffers = self._aerosol_heights, self._aerosol_bottoms
+        n, n_new = len(self.df), len(new_df)
+
+        # Aerosol models are first found in the new records when the log was followed from its first record
+        for label in new_df:
+            if label not in self._buffers:
+                self._buffers[label] = np.full(n, np.nan)
+            self._buffers[label] = _grow(self._buffers[label], n + n_new)
+            self._buffers[label][n:n + n_new] = new_df[label].to_numpy()
+        self.df = pd.DataFrame(OrderedDict((label, buffer[:n + n_new]) for label, buffer in self._buffers.items()),
+                               copy=False)
+
+        if heights is not None:
+            if self._stack_buffers is None:
+                self._stack_buffers = tuple(np.full((n,) + heights.shape[1:], np.nan) for _ in range(2))
+            self._stack_buffers = tuple(_grow(buffer, n + n_new) for buffer in self._stack_buffers)
+            for buffer, rows in zip(self._stack_buffers, (heights, bottoms)):
+                buffer[n:n + n_new] = rows
+            self._aerosol_heights, self._aerosol_bottoms = (buffer[:n + n_new] for buffer in self._stack_buffers)
+
+        # Parsed columns, e.g. stacked again by weighted(), hold all the records as well
+        self._date_buffer = _grow(self._date_buffer, n + n_new)
+        self._date_buffer[n:n + n_new] = date_list
+        self._date_list = self._date_buffer[:n + n_new]
+        if props_arr is not None:
+            if self._props_buffer is None:
+                self._props_buffer = np.full((n, len(props_list)), np.nan)
+                self._props_list = props_list
+            self._props_buffer = _grow(self._props_buffer, n + n_new)
+            self._props_buffer[n:n + n_new] = props_arr
+            self._props_arr = self._props_buffer[:n + n_new]
+        for _, label, name in self._scalar_columns() + ((None, self.lbl_total_aot, '_total_AOT_list'),):
+            if label in self._buffers:
+                setattr(self, name, self._buffers[label][:n + n_new])
+
+        self._resampled.clear()
+        self._date_index = None
+        return n_new
+
+    def _parse_maqt_file(self, filename, jobs=1, mmap_threshold=MMAP_THRESHOLD, verbose=False):
+        # Stream the lines of the file, scan it as bytes through mmap if large, or split it across
+        # worker processes. Large compressed files are scanned as bytes while being decompressed.
+        # Pushed down fields and dates let the bytes scan skip most lines, whatever the file size
+        if self._pushdown and mmap_threshold is not None:
+            mmap_threshold = 1
+        large = mmap_threshold is not None and os.path.isfile(filename) \
+                and os.path.getsize(filename) >= max(mmap_threshold, 1)
+
+        indexed = self._index is not None and self._date_window is not None and os.path.isfile(filename)
+        if detect_compression(filename) is not None:
+            if jobs > 1 and verbose:
+                print("INFO: compressed %s cannot be split, parsing it in a single process" % filename)
+            if large:
+                return self._parse_maqt_stream(self._open_file(filename, verbose))
+
+        elif indexed:
+            return self._parse_maqt_ranges(filename, self._index.ranges(filename, *self._date_window, verbose=verbose),
+                                           verbose)
+
+        elif jobs > 1 and os.path.isfile(filename):
+            return self._parse_maqt_log_parallel(filename, jobs, verbose)
+
+        elif large:
+            return self._parse_maqt_log(self._map_file(filename, verbose))
+
+        return self._parse_maqt_log(self._iter_file_lines(filename, verbose))
+
+    def _parse_maqt_ranges(self, filename, ranges, verbose=False):
+        # Each range starts on a record, whose date line sets the parser window state
+        parser = self._new_parser()
+        if ranges:
+            with self._map_file(filename, verbose) as buffer:
+                for start, end in ranges:
+                    parser.scan(buffer, start, end)
+
+        return self._parser_columns(parser)
+
+    def _parse_maqt_stream(self, f):
+        parser = self._new_parser()
+        with f, contextlib.closing(_read_blocks(f)) as blocks:
+            tail = b''
+            for block in blocks:
+                block = tail + block
+                end = block.rfind(b'\n') + 1
+                if end:
+                    parser.scan(block, 0, end)
+                tail = block[end:]
+            if tail:
+                parser.scan(tail)
+
+        return self._parser_columns(parser)
+
+    def _parse_maqt_log_parallel(self, filename, jobs, verbose=False):
+        # With a date window, chunks start on a record, for its date to tell whether to skip its lines
+        chunks = self._split_file(filename, jobs, b'L1C' if self._date_window is not None else None)
+        if verbose:
+            print("INFO: parsing %s in %d chunks over %d processes" % (filename, len(chunks), jobs))
+
+        parser = MaqtParser(self._maqt_regex_table)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_parse_maqt_chunk, filename, start, end, self._maqt_regex_table,
+                                       self._date_window) for start, end in chunks]
+            for future in futures:
+                parser.merge(future.result())
+
+        return self._parser_columns(parser)
+
+    @staticmethod
+    def _parser_columns(parser):
+        return parser.date_list, parser.rh_list, parser.props_arr, parser.props_list, parser.cloud_list, \
+               parser.cirrus_list, parser.ozone_list, parser.weight_prev_cams_date_list, \
+               parser.weight_next_cams_date_list, parser.prev_aot_list, parser.next_aot_list
 
     def _set_aerosols_list(self):
         return self._props_list
 
-    def plot_clouds(self):
-        fig, ax1 = pl.subplots(figsize=(12, 6))
+    def _plot_frame(self, resample=None, bins=RESAMPLE_BINS, key_column=None):
+        # Plotted series (dates, RH, cloud fraction and aerosol bar heights) resampled to bins rows, or None at
+        # full resolution. Resampled frames are cached, so that several plots share the aggregation
+        if resample is None or len(self.df) <= bins:
+            return None
 
-        ax1.bar(self.df[self.lbl_date], self.df[self.lbl_cloud], label=self.lbl_cloud)
+        cache_key = (resample, bins, key_column if resample == 'lttb' else None)
+        if cache_key not in self._resampled:
+            labels = [label for label in (self.lbl_date, self.lbl_rh, self.lbl_cloud) if label in self.df]
+            frame = pd.DataFrame({label: self.df[label].to_numpy() for label in labels})
+            if self._aerosol_heights is not None:
+                heights = pd.DataFrame(self._aerosol_heights, columns=self._props_list)
+                frame = pd.concat([frame, heights], axis=1)
+            self._resampled[cache_key] = resample_frame(frame, bins, resample, self.lbl_date, key_column)
+
+        return self._resampled[cache_key]
+
+    @staticmethod
+    def _draw_bars(ax, dates, heights, bottoms=0, label=None, steps=False, width=0.8):
+        # Bars create one Rectangle per date, while a filled step area is a single PolyCollection
+        if not steps:
+            return ax.bar(dates, heights, width=width, bottom=bottoms, label=label)
+
+        bottoms = np.broadcast_to(bottoms, np.shape(heights))
+        return ax.fill_between(dates, bottoms, bottoms + heights, step='mid', label=label)
+
+    def _bar_width(self, frame):
+        # Resampled bars span most of their bin, full resolution bars are 0.8 day wide
+        if frame is None or len(frame) < 2:
+            return 0.8
+        return 0.8 * np.median(np.diff(frame[self.lbl_date].to_numpy())) / np.timedelta64(1, 'D')
+
+    @staticmethod
+    def _use_steps(n_dates, steps=None):
+        return n_dates > STEP_PLOT_THRESHOLD if steps is None else steps
+
+    @staticmethod
+    def _legend_location(steps):
+        # Searching the 'best' location scans every vertex, too slow for long series
+        return 'upper left' if steps else 'best'
+
+    @staticmethod
+    def _render_clouds(filename, title, dates, clouds, label, steps, width):
+        # Module-level state free, so that figures can be rendered in worker processes
+        fig, ax1 = _new_figure()
+
+        Log._draw_bars(ax1, dates, clouds, label=label, steps=steps, width=width)
         ax1.set_ylabel('Fraction (-)')
-        pl.legend()
+        ax1.legend(loc=Log._legend_location(steps))
 
         fig.autofmt_xdate()
-        pl.title(self._log_file_name)
-        pl.savefig(self._log_file_name[:-4] + "_clouds.png")
-
-    def plot_aerosols(self):
-        fig, ax1 = pl.subplots(figsize=(12, 6))
+        ax1.set_title(title)
+        fig.savefig(filename)
+        return filename
 
-        aerosols = self._set_aerosols_list()
+    @staticmethod
+    def _render_aerosols(filename, title, dates, heights, bottoms, aerosols, rh, steps, width):
+        from matplotlib.dates import DateFormatter
+        fig, ax1 = _new_figure()
 
-        stack = 0
-        for aerosol in aerosols:
-            if self._weight_by_tau:
-                ax1.bar(self.df[self.lbl_date], self.df[aerosol] * self.df[self.lbl_total_aot], bottom=stack,
-                        label=aerosol)
-                stack += self.df[aerosol] * self.df[self.lbl_total_aot]
-            else:
-                ax1.bar(self.df[self.lbl_date], self.df[aerosol], bottom=stack, label=aerosol)
-                stack += self.df[aerosol]
+        for i, aerosol in enumerate(aerosols):
+            Log._draw_bars(ax1, dates, heights[:, i], bottoms[:, i], aerosol, steps, width)
 
-        ax1.xaxis.set_major_formatter(pl.DateFormatter("%y/%m/%d"))
-        ax1.xaxis.set_minor_formatter(pl.DateFormatter("%d"))
+        ax1.xaxis.set_major_formatter(DateFormatter("%y/%m/%d"))
+        ax1.xaxis.set_minor_formatter(DateFormatter("%d"))
         ax1.set_ylabel('CAMS AOT with aerosol fractions (-)')
-        pl.legend()
+        ax1.legend(loc=Log._legend_location(steps))
 
         ax2 = ax1.twinx()
         ax2.set_ylabel('Relative humidity (%)')
-        ax2.plot(self.df[self.lbl_date], self.df[self.lbl_rh])
+        ax2.plot(dates, rh)
 
         fig.autofmt_xdate()
-        pl.title(self._log_file_name)
-        pl.savefig(self._log_file_name[:-4] + "_aerosols.png")
+        ax2.set_title(title)
+        fig.savefig(filename)
+        return filename
+
+    def _clouds_figure(self, steps=None, resample=None, bins=RESAMPLE_BINS):
+        frame = self._plot_frame(resample, bins, self.lbl_cloud)
+        width = self._bar_width(frame)
+        if frame is None:
+            frame = self.df
+
+        return self._render_clouds, dict(filename=self._log_file_name[:-4] + "_clouds.png",
+                                         title=self._log_file_name, dates=frame[self.lbl_date].to_numpy(),
+                                         clouds=frame[self.lbl_cloud].to_numpy(), label=self.lbl_cloud,
+                                         steps=self._use_steps(len(frame), steps), width=width)
+
+    def _aerosols_figure(self, steps=None, resample=None, bins=RESAMPLE_BINS):
+        aerosols = self._set_aerosols_list()
+
+        frame = self._plot_frame(resample, bins, self.lbl_rh)
+        if frame is None:
+            dates, rh = self.df[self.lbl_date].to_numpy(), self.df[self.lbl_rh].to_numpy()
+            heights, bottoms = self._aerosol_heights, self._aerosol_bottoms
+        else:
+            dates, rh = frame[self.lbl_date].to_numpy(), frame[self.lbl_rh].to_numpy()
+            heights, bottoms = aerosol_stack(frame[list(aerosols)].to_numpy())
+
+        return self._render_aerosols, dict(filename=self._log_file_name[:-4] + "_aerosols.png",
+                                           title=self._log_file_name, dates=dates, heights=heights,
+                                           bottoms=bottoms, aerosols=list(aerosols), rh=rh,
+                                           steps=self._use_steps(len(dates), steps), width=self._bar_width(frame))
+
+    def figures(self, steps=None, resample=None, bins=RESAMPLE_BINS):
+        """
+        Rendering functions of the aerosols and clouds plots, with their arguments
+
+        Both are plain picklable data, so that the figures can be rendered in other processes. Figures
+        needing fields left unparsed, or aerosol models found in no record, are left out.
+
+        :param steps: draw step areas, or None to do so above STEP_PLOT_THRESHOLD dates
+        :param resample: downsample the series to bins dates with one of RESAMPLE_METHODS, or None
+        :param bins: number of dates of resampled series
+        :return: list of (function, keyword arguments), each call saving a PNG file and returning its name
+        """
+        figures = []
+        if self._parsed('cams_ratio', 'rh') and self._aerosol_heights is not None:
+            figures.append(self._aerosols_figure(steps, resample, bins))
+        if self._parsed('cloud_fraction'):
+            figures.append(self._clouds_figure(steps, resample, bins))
+        return figures
+
+    def plot_clouds(self, steps=None, resample=None, bins=RESAMPLE_BINS):
+        """
+        Plot the cloud fraction as bars, or as a filled step area for long series
+
+        :param steps: draw a step area, or None to do so above STEP_PLOT_THRESHOLD dates
+        :param resample: downsample the series to bins dates with one of RESAMPLE_METHODS, or None
+        :param bins: number of dates of resampled series
+        :return: PNG file name
+        """
+        render, kwargs = self._clouds_figure(steps, resample, bins)
+        return render(**kwargs)
+
+    def plot_aerosols(self, steps=None, resample=None, bins=RESAMPLE_BINS):
+        """
+        Plot the aerosol models as stacked bars, or as stacked filled step areas for long series
 
-    def save_table(self):
-        with open(self._log_file_name[:-4] + "_table.csv", 'w') as f:
-            f.write(self.df.to_string())
+        :param steps: draw step areas, or None to do so above STEP_PLOT_THRESHOLD dates
+        :param resample: downsample the series to bins dates with one of RESAMPLE_METHODS, or None
+        :param bins: number of dates of resampled series
+        :return: PNG file name
+        """
+        render, kwargs = self._aerosols_figure(steps, resample, bins)
+        return render(**kwargs)
+
+    def save_table(self, table_format='csv'):
+        """
+        Save the DataFrame as a table file
+
+        :param table_format: one of TABLE_FORMATS, 'parquet' and 'feather' requiring pyarrow
+        :return: table file name
+        """
+        suffix, writer = TABLE_FORMATS[table_format]
+        filename = self._log_file_name[:-4] + suffix
+        try:
+            with self.profiler.stage('save table'):
+                writer(self.df, filename)
+
+        except ImportError as error:
+            print("ERROR: cannot write %s table: %s" % (table_format, error))
+            sys.exit(1)
+
+        self._table_columns = list(self.df.columns)
+        return filename
+
+    def append_table(self, n_records, table_format='csv'):
+        """
+        Append the last records of the DataFrame to the table file saved by save_table(), e.g. after refresh()
+
+        Only CSV tables are appended to. Tables of other formats, or whose columns changed since they were saved,
+        e.g. once the first aerosol models are found, are saved again in full.
+
+        :param n_records: number of records to append
+        :param table_format: one of TABLE_FORMATS
+        :return: table file name
+        """
+        if table_format != 'csv' or self._table_columns != list(self.df.columns):
+            return self.save_table(table_format)
+
+        filename = self._log_file_name[:-4] + TABLE_FORMATS[table_format][0]
+        with self.profiler.stage('save table'):
+            self.df.iloc[len(self.df) - n_records:].to_csv(filename, mode='a', header=False, index=False)
+
+        return filename
+
+
+def merge_logs(logs, drop_duplicates=True, source_label='Source'):
+    """
+    Merge the records of many logs into one date-indexed, date-sorted frame
+
+    :param logs: Log instances
+    :param drop_duplicates: drop the records found identical in several logs, keeping the first one
+    :param source_label: name of the log file column
+    :return: DataFrame indexed by date
+    """
+    if not logs:
+        raise ValueError("merge_logs() needs at least one log")
+
+    return merge_frames([log.df for log in logs], [log._log_file for log in logs], drop_duplicates, source_label,
+                        logs[0].lbl_date)
+
+
+def merge_frames(frames, sources, drop_duplicates=True, source_label='Source', date_label='Date'):
+    """
+    Merge the DataFrames of many logs into one date-indexed, date-sorted frame, e.g. those of a batch run
+
+    The date-sorted records of each log are merged run by run, instead of sorting them all again. Records
+    of equal dates keep the order of frames. The log file of each record is kept as a categorical column.
+
+    :param frames: Log DataFrames
+    :param sources: log file of each frame
+    :param drop_duplicates: drop the records found identical in several logs, keeping the first one
+    :param source_label: name of the log file column
+    :param date_label: name of the date column
+    :return: DataFrame indexed by date
+    """
+    if not len(frames):
+        raise ValueError("merge_frames() needs at least one frame")
+
+    sorted_frames = []
+    for df in frames:
+        # A log is written in chronological order, but reprocessed dates may come back: sort those few only
+        if not df[date_label].is_monotonic_increasing:
+            df = df.sort_values(date_label, kind='stable', ignore_index=True)
+        sorted_frames.append(df)
+
+    # The stable argsort is a timsort: it finds the sorted run of each log and merges the runs, in C
+    order = np.argsort(np.concatenate([df[date_label].to_numpy() for df in sorted_frames]), kind='stable')
+    rows_frame = np.repeat(np.arange(len(sorted_frames), dtype=np.int32), [len(df) for df in sorted_frames])[order]
+
+    merged = pd.concat(sorted_frames, ignore_index=True).take(order)
+    if drop_duplicates:
+        keep = ~merged.duplicated().to_numpy()
+        merged, rows_frame = merged[keep], rows_frame[keep]
+
+    # Categorical codes take one byte per record for up to 127 logs, instead of one file name object
+    names = list(OrderedDict.fromkeys(sources))
+    codes = np.array([names.index(source) for source in sources])
+    merged[source_label] = pd.Categorical.from_codes(codes[rows_frame], categories=names)
+
+    return merged.set_index(date_label)
+
+
+class LogStore:
+    """
+    In-memory LRU cache of parsed logs and of their rendered plots, for the server mode
+
+    A log is parsed again once its size or mtime changed. Least recently used logs are evicted once their
+    DataFrames and PNG plots grow over max_bytes. Plots are rendered one at a time, matplotlib not being
+    thread-safe.
+    """
+
+    def __init__(self, max_bytes=SERVER_MAX_BYTES, cache=None, verbose=False):
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.verbose = verbose
+        self._entries = OrderedDict()  # Log path -> dict of stat signature, Log, tau-weighted Log, plots, bytes
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+
+    def get(self, filename):
+        """
+        Parsed log, from memory unless changed since it was parsed
+
+        :param filename: MAQT log file
+        :return: Log
+        """
+        return self._entry(filename)['log']
+
+    def plot(self, filename, kind, tau_weight=False, date_from=None, date_to=None, resample=None, bins=RESAMPLE_BINS):
+        """
+        PNG plot of a log, rendered on the first request only
+
+        :param filename: MAQT log file
+        :param kind: 'aerosols' or 'clouds'
+        :param tau_weight: weight aerosols with tau
+        :param date_from: first date plotted, or None from the first record
+        :param date_to: last date plotted, or None up to the last record
+        :param resample: downsample the series with one of RESAMPLE_METHODS, or None
+        :param bins: number of dates of resampled series
+        :return: PNG bytes
+        """
+        entry = self._entry(filename)
+        key = (kind, tau_weight, date_from, date_to, resample, bins)
+        png = entry['plots'].get(key)
+        if png is None:
+            log = entry['log']
+            if tau_weight:
+                # The tau-weighted aerosol stack is computed once, on the parsed data of the log
+                if entry['tau_log'] is None:
+                    entry['tau_log'] = log.weighted(True)
+                    with self._lock:
+                        entry['bytes'] += entry['tau_log']._aerosol_heights.nbytes * 2
+                log = entry['tau_log']
+            view = log.window(date_from, date_to)
+            figure = view._aerosols_figure if kind == 'aerosols' else view._clouds_figure
+            render, kwargs = figure(None, resample, bins)
+            kwargs['filename'] = io.BytesIO()
+            with self._render_lock:
+                png = render(**kwargs).getvalue()
+
+            with self._lock:
+                entry['plots'][key] = png
+                entry['bytes'] += len(png)
+                self._evict()
+
+        return png
+
+    def status(self):
+        """
+        Cached logs, most recently used last
+
+        :return: list of dicts of log path, number of records and plots, bytes
+        """
+        with self._lock:
+            return [{'log': path, 'records': len(entry['log'].df), 'plots': len(entry['plots']),
+                     'bytes': entry['bytes']} for path, entry in self._entries.items()]
+
+    def _entry(self, filename):
+        key = os.path.abspath(filename)
+        stat = os.stat(filename)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['signature'] == signature:
+                self._entries.move_to_end(key)
+                return entry
+
+        # Parsed out of the lock, so that cached logs are served meanwhile
+        if self.verbose:
+            print("INFO: parsing %s" % filename)
+        log = Log(filename, cache=self.cache)
+        size = log.df.memory_usage(deep=True).sum()
+        if log._aerosol_heights is not None:
+            size += log._aerosol_heights.nbytes + log._aerosol_bottoms.nbytes
+        entry = {'signature': signature, 'log': log, 'tau_log': None, 'plots': {}, 'bytes': int(size)}
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+
+        return entry
+
+    def _evict(self):
+        # The most recent entry is kept, even alone over max_bytes
+        total = sum(entry['bytes'] for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry['bytes']
+
+
+class LogRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP requests of the server mode, log paths being relative to the served directory:
+
+        GET /table/<log>?format=json|csv&from=DATE&to=DATE&columns=COLUMN,...
+        GET /plot/<log>?kind=aerosols|clouds&from=DATE&to=DATE&resample=METHOD&bins=N&tau=1
+        GET /status
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        route, _, path = url.path.lstrip('/').partition('/')
+        try:
+            if route == 'status':
+                return self._send(200, 'application/json', json.dumps(self.server.store.status()).encode())
+            if route not in ('table', 'plot'):
+                return self.send_error(404, "Unknown route /%s" % route)
+
+            filename = self._log_path(urllib.parse.unquote(path))
+            if filename is None:
+                return self.send_error(404, "No log %s" % path)
+
+            date_from = pd.Timestamp(query['from']) if 'from' in query else None
+            date_to = pd.Timestamp(query['to']) if 'to' in query else None
+            if route == 'plot':
+                tau_weight = query.get('tau', '0') not in ('', '0', 'false')
+                kind = query.get('kind', 'aerosols')
+                resample = query.get('resample')
+                bins = int(query.get('bins', RESAMPLE_BINS))
+                if kind not in ('aerosols', 'clouds') or resample not in RESAMPLE_METHODS + (None,) or bins < 1:
+                    return self.send_error(400, "Bad plot kind %s, resample %s or bins %d" % (kind, resample, bins))
+                png = self.server.store.plot(filename, kind, tau_weight, date_from, date_to, resample, bins)
+                return self._send(200, 'image/png', png)
+
+            table_format = query.get('format', 'json')
+            if table_format not in ('json', 'csv'):
+                return self.send_error(400, "Bad table format %s" % table_format)
+            df = self.server.store.get(filename).between(date_from, date_to)
+            if 'columns' in query:
+                df = df[[df.columns[0]] + [column for column in query['columns'].split(',') if column in df]]
+            if table_format == 'csv':
+                return self._send(200, 'text/csv', df.to_csv(index=False).encode())
+            return self._send(200, 'application/json', df.to_json(orient='records', date_format='iso').encode())
+
+        except ValueError as error:
+            return self.send_error(400, str(error))
+
+        except SystemExit:
+            return self.send_error(422, "%s is not a MAQT log" % path)
+
+    def _log_path(self, path):
+        # Logs outside of the served directory are not found
+        filename = os.path.realpath(os.path.join(self.server.root, path))
+        if not filename.startswith(self.server.root + os.sep) or not os.path.isfile(filename):
+            return None
+        return filename
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.store.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(root, port=SERVER_PORT, host='127.0.0.1', max_bytes=SERVER_MAX_BYTES, cache=None, verbose=False):
+    """
+    HTTP server of the tables and plots of the logs of a directory, keeping the parsed logs warm
+
+    :param root: served directory
+    :param port: TCP port, 0 for any free one
+    :param host: listening address
+    :param max_bytes: memory bound of the parsed logs and plots kept
+    :param cache: ParseCache, to load the logs evicted from memory faster, or None
+    :param verbose: print the requests and parsings
+    :return: ThreadingHTTPServer, to serve_forever()
+    """
+    server = http.server.ThreadingHTTPServer((host, port), LogRequestHandler)
+    server.root = os.path.realpath(root)
+    server.store = LogStore(max_bytes, cache, verbose)
+    return server
+
+
+class _ErrorRecorder:
+    """
+    Text stream writing through to another one, and keeping the last error message printed, e.g. before a
+    sys.exit(), to report it
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._error = None
+
+    @property
+    def error(self):
+        """Last 'ERROR: ...' message printed, with its continuation lines, on a single line, or None"""
+        return None if self._error is None else ' '.join(''.join(self._error)[len('ERROR: '):].split())
+
+    def write(self, text):
+        if text.startswith('ERROR: '):
+            self._error = []
+        if self._error is not None:
+            self._error.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def process_log(filename, tau_weight=False, verbose=False, jobs=1, plots=True, table_format='csv', cache=None,
+                resample=None, bins=RESAMPLE_BINS, plot_executor=None, profile=False, date_from=None, date_to=None,
+                fields=None, index=None, keep_frame=False):
+    """
+    Parse a log then save its plots and table, reporting failures instead of exiting
+
+    :param filename: MAQT log file
+    :param tau_weight: weight aerosols with tau
+    :param verbose: set verbosity to INFO level
+    :param jobs: number of processes parsing the log
+    :param plots: save the plots, else the table only
+    :param table_format: table file format, one of TABLE_FORMATS
+    :param cache: ParseCache, or None to always parse
+    :param resample: plot resampling method, one of RESAMPLE_METHODS, or None
+    :param bins: number of dates of resampled plots
+    :param plot_executor: process pool rendering the figures, or None to render them in this process
+    :param profile: print the per-stage metrics of the log
+    :param date_from: first date plotted and saved, or None from the first record
+    :param date_to: last date plotted and saved, or None up to the last record
+    :param fields: fields to parse, some of MAQT_FIELDS, or None for all
+    :param index: LogIndex to seek the records from date_from to date_to, or None to scan the log
+    :param keep_frame: also return the DataFrame of the log, e.g. to merge the logs of a batch
+    :return: file name, status ('OK' or 'FAILED'), error message, elapsed time in seconds, followed by the
+             DataFrame of the log, or None if failed, with keep_frame
+    """
+    start = time.perf_counter()
+    frame = (None,) if keep_frame else ()
+    output = _ErrorRecorder(sys.stdout)
+    try:
+        with contextlib.redirect_stdout(output):
+            log = Log(filename, tau_weight, verbose, jobs=jobs, cache=cache, profile=profile, fields=fields,
+                      date_from=date_from, date_to=date_to, index=index)
+            if plots:
+                with log.profiler.stage('plots'):
+                    render_plots([log], resample=resample, bins=bins, executor=plot_executor)
+            log.save_table(table_format)
+
+            if profile:
+                print("INFO: profile of %s\n%s" % (filename, log.profiler.report()))
+
+    except SystemExit as error:
+        return (filename, 'FAILED', output.error or "exit status %s" % error.code, time.perf_counter() - start) \
+               + frame
+
+    except Exception as error:
+        return (filename, 'FAILED', "%s: %s" % (type(error).__name__, error), time.perf_counter() - start) + frame
+
+    return (filename, 'OK', '', time.perf_counter() - start) + ((log.df,) if keep_frame else ())
+
+
+def run_batch(filenames, workers=1, plot_workers=1, **options):
+    """
+    Process many logs in one interpreter, over a pool of worker processes
+
+    :param filenames: MAQT log files
+    :param workers: number of worker processes
+    :param plot_workers: number of processes rendering the figures, shared by all logs. Only used with a single
+                         worker, as several workers already render the logs' figures in parallel
+    :param options: process_log keyword arguments, e.g. tau_weight, jobs, plots or date_from
+    :return: list of process_log results, in the order of filenames
+    """
+    # Logs of the same name, e.g. x.log and x.log.gz, would write the same table and plots, at the same time with
+    # several workers: the later ones fail instead
+    results = OrderedDict.fromkeys(range(len(filenames)))
+    owners = {}
+    for i, filename in enumerate(filenames):
+        owner = owners.setdefault(Log._get_log_name(filename)[:-4], i)
+        if owner != i:
+            results[i] = (filename, 'FAILED', "same table and plot files as %s" % filenames[owner], 0.) \
+                         + ((None,) if options.get('keep_frame') else ())
+    pending = [i for i, result in results.items() if result is None]
+
+    if workers <= 1:
+        plot_executor = _plot_executor(options.get('plots', True), plot_workers)
+        try:
+            for i in pending:
+                results[i] = process_log(filenames[i], plot_executor=plot_executor, **options)
+
+        finally:
+            if plot_executor is not None:
+                plot_executor.shutdown()
+
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            processed = executor.map(functools.partial(process_log, **options), [filenames[i] for i in pending])
+            results.update(zip(pending, processed))
+
+    return list(results.values())
+
+
+def _plot_executor(plots, plot_workers):
+    if not plots or plot_workers <= 1:
+        return None
+
+    return concurrent.futures.ProcessPoolExecutor(max_workers=plot_workers)
+
+
+def write_batch_summary(results, summary_file=None):
+    """
+    Print the per-file status of a batch run, and write it as CSV to summary_file if given
+
+    :param results: run_batch results
+    :param summary_file: optional CSV output
+    """
+    summary = pd.DataFrame(results, columns=['File', 'Status', 'Error', 'Seconds'])
+    print(summary.to_string(index=False))
+
+    if summary_file is not None:
+        summary.to_csv(summary_file, index=False)
+
+
+def _expand_files(patterns):
+    filenames = []
+    for pattern in patterns:
+        # Patterns matching no file are kept as is, to be reported as not found
+        filenames.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    return filenames
+
+
+def _fields_arg(value):
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in MAQT_FIELDS]
+    if unknown or not fields:
+        raise argparse.ArgumentTypeError("unknown field(s) %s, expected some of %s" % (unknown, ', '.join(MAQT_FIELDS)))
+
+    return fields
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("FILE", help="MiniLut File")
+    parser.add_argument("FILE", help="MiniLut File(s) or glob pattern(s)", nargs='+')
     parser.add_argument("-v", "--verbose", help="Set verbosity to INFO level + interactive plotting",
                         action="store_true")
     parser.add_argument("-t", "--tau", help="Weight aerosols with tau", action="store_true")
+    parser.add_argument("-j", "--jobs", help="Number of processes parsing the log in parallel", type=int, default=1)
+    parser.add_argument("-w", "--workers", help="Number of processes handling the logs of a batch", type=int,
+                        default=1)
+    parser.add_argument("-p", "--plot-workers", help="Number of processes rendering the plots", type=int,
+                        default=1)
+    parser.add_argument("-m", "--merge", help="Write the date-sorted, de-duplicated records of all the logs to this "
+                                              "table file")
+    parser.add_argument("-s", "--summary", help="Write the per-file status of the logs to this CSV file")
+    parser.add_argument("--no-plots", "--table-only", help="Only save the table, without loading matplotlib",
+                        dest="plots", action="store_false")
+    parser.add_argument("-f", "--format", help="Table file format", choices=list(TABLE_FORMATS), default='csv')
+    parser.add_argument("--no-cache", help="Always parse the logs, without reading or writing the parse cache",
+                        dest="cache", action="store_false")
+    parser.add_argument("--follow", help="Keep parsing the lines appended to the log every SECONDS and update the "
+                                         "plots and table, until interrupted", type=float, metavar="SECONDS")
+    parser.add_argument("--resample", help="Downsample the plotted series of long logs", choices=RESAMPLE_METHODS)
+    parser.add_argument("--bins", help="Number of dates of resampled plots", type=int, default=RESAMPLE_BINS)
+    parser.add_argument("--from", help="Only parse the records from this date on, e.g. 2015-07-01",
+                        dest="date_from", type=pd.Timestamp)
+    parser.add_argument("--to", help="Only parse the records up to this date, included", dest="date_to",
+                        type=pd.Timestamp)
+    parser.add_argument("--fields", help="Only parse these comma-separated fields, besides the dates, some of %s"
+                                         % ', '.join(MAQT_FIELDS), type=_fields_arg, metavar="FIELD[,FIELD...]")
+    parser.add_argument("--index", help="Seek the records from --from to --to through a sidecar index of each log, "
+                                        "built on first use", action="store_true")
+    parser.add_argument("--serve", help="Serve the tables and plots of the logs of the FILE directory, or of the "
+                                        "directory of the FILE logs, over HTTP on this port, keeping the parsed "
+                                        "logs in memory", type=int, metavar="PORT")
+    parser.add_argument("--host", help="Listening address of --serve", default='127.0.0.1')
+    parser.add_argument("--server-memory", help="Memory bound in MB of the parsed logs and plots kept by --serve",
+                        type=int, default=SERVER_MAX_BYTES // 1024 ** 2)
+    parser.add_argument("--profile", help="Print the wall time, CPU time and peak memory of each stage, and the "
+                                          "number of lines of each field, bypassing the parse cache",
+                        action="store_true")
+    parser.add_argument("--pstats", help="Dump cProfile statistics of the run to this file, for pstats")
 
     args = parser.parse_args()
+    if args.pstats is None:
+        _run(args)
+
+    else:
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(_run, args)
+
+        finally:
+            profile.dump_stats(args.pstats)
+            print("INFO: cProfile statistics written to %s" % args.pstats)
+
+
+def _run(args):
+    filenames = _expand_files(args.FILE)
+    cache = ParseCache() if args.cache else None
+    index = LogIndex() if args.index else None
+    if args.serve is not None:
+        # A directory is served as is, logs through their common directory
+        if len(args.FILE) == 1 and os.path.isdir(args.FILE[0]):
+            root = args.FILE[0]
+        else:
+            root = os.path.commonpath([os.path.dirname(os.path.abspath(filename)) for filename in filenames])
+
+        server = make_server(root, args.serve, args.host, args.server_memory * 1024 ** 2, cache, args.verbose)
+        print("INFO: serving the logs of %s on http://%s:%d/" % (root, args.host, server.server_address[1]))
+        try:
+            server.serve_forever()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            server.server_close()
+
+        print("INFO: Done...")
+        sys.exit(0)
+
+    if args.follow is not None and (len(filenames) > 1 or args.merge is not None or args.summary is not None):
+        print("ERROR: --follow needs a single log, without -m/--merge or -s/--summary...")
+        sys.exit(1)
+
+    # A single log is handled as a batch too when its summary or merged table is asked for
+    if len(filenames) > 1 or args.merge is not None or args.summary is not None:
+        merge = args.merge is not None
+        results = run_batch(filenames, args.workers, args.plot_workers, tau_weight=args.tau, verbose=args.verbose,
+                            jobs=args.jobs, plots=args.plots, table_format=args.format, cache=cache,
+                            resample=args.resample, bins=args.bins, profile=args.profile, date_from=args.date_from,
+                            date_to=args.date_to, fields=args.fields, index=index, keep_frame=merge)
+        write_batch_summary([result[:4] for result in results], args.summary)
+
+        # The frames parsed by the batch are merged, instead of parsing the logs again
+        merged = [(result[0], result[4]) for result in results if merge and result[1] == 'OK']
+        if merged:
+            sources, frames = zip(*merged)
+            TABLE_FORMATS[args.format][1](merge_frames(frames, sources).reset_index(), args.merge)
+            print("INFO: merged %d log(s) into %s" % (len(frames), args.merge))
+
+        failed = sum(result[1] != 'OK' for result in results)
+        print("INFO: Done, %d/%d log(s) failed..." % (failed, len(results)))
+        sys.exit(1 if failed else 0)
+
+    log = Log(filenames[0], args.tau, args.verbose, jobs=args.jobs, cache=cache, follow=args.follow is not None,
+              profile=args.profile, fields=args.fields, date_from=args.date_from, date_to=args.date_to, index=index)
+    plot_executor = _plot_executor(args.plots, args.plot_workers)
+    if args.plots:
+        with log.profiler.stage('plots'):
+            render_plots([log], resample=args.resample, bins=args.bins, executor=plot_executor)
+    log.save_table(args.format)
+
+    if args.follow is not None:
+        try:
+            while True:
+                time.sleep(args.follow)
+                n = log.refresh()
+                if n:
+                    if args.plots:
+                        with log.profiler.stage('plots'):
+                            render_plots([log], resample=args.resample, bins=args.bins, executor=plot_executor)
+                    log.append_table(n, args.format)
+                    print("INFO: %d new record(s), %d in total" % (n, len(log.df)))
+
+        except KeyboardInterrupt:
+            pass
+
+    if plot_executor is not None:
+        plot_executor.shutdown()
 
-    log = Log(args.FILE, args.tau, args.verbose)
-    log.plot_aerosols()
-    log.plot_clouds()
-    log.save_table()
+    if args.profile:
+        print(log.profiler.report())
 
     print("INFO: Done...")
     sys.exit(0)
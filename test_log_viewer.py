@@ -0,0 +1,395 @@
+"""
+Tests of log_viewer on small synthetic MAQT logs
+
+    python -m pytest -q test_log_viewer.py
+"""
+
+import os
+import io
+import bz2
+import gzip
+import lzma
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pytest
+
+import log_viewer
+from benchmark import generate_maqt_log, _peak_rss_mb
+
+N_LINES = 2400  # 200 records
+
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    """Synthetic log, tables and plots being saved next to it"""
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "T31TCJ.log")
+    generate_maqt_log(filename, N_LINES)
+    return filename
+
+
+@pytest.fixture
+def full_df(log_file):
+    return log_viewer.Log(log_file, mmap_threshold=None).df
+
+
+def _compress(filename, opener, suffix):
+    with open(filename, 'rb') as f, opener(filename + suffix, 'wb') as out:
+        out.write(f.read())
+    return filename + suffix
+
+
+def test_peak_rss_bounded(tmp_path):
+    # Streamed parsing holds typed columns only: peak RSS grows slower than the log
+    sizes, peak_rss = [], []
+    for n_lines in (24000, 240000):
+        filename = str(tmp_path / ("rss_%d.log" % n_lines))
+        generate_maqt_log(filename, n_lines)
+        sizes.append(os.path.getsize(filename) / 1024 ** 2)
+        peak_rss.append(_peak_rss_mb(filename, False))
+
+    assert peak_rss[1] - peak_rss[0] < sizes[1] - sizes[0]
+
+
+def test_pairs_decoder():
+    decoder = log_viewer.PairsDecoder()
+    assert decoder.decode(" [('SEASALT', 0.25), ('DUST', 0.75)]\n") == (['DUST', 'SEASALT'], [0.75, 0.25])
+    assert decoder.decode(" {'SEASALT': 0.5, 'DUST': 0.5}\n") == (['DUST', 'SEASALT'], [0.5, 0.5])
+    with pytest.raises(ValueError):
+        decoder.decode(" __import__('os')\n")
+
+
+def test_aerosol_models_must_not_change():
+    parser = log_viewer.MaqtParser(OrderedDict([('cams_ratio', "^temporalInterpProps")]))
+    parser.feed("temporalInterpProps: [('DUST', 0.25), ('SEASALT', 0.75)]\n")
+    with pytest.raises(ValueError):
+        parser.feed("temporalInterpProps: [('FOO', 0.25), ('BAR', 0.75)]\n")
+
+
+def test_props_parsing_scales_linearly():
+    models = ['DUST', 'SEASALT', 'SULPHATE', 'ORGANICMATTER', 'BLACKCARBON']
+    rng = np.random.default_rng(0)
+    per_record = []
+    for n_records in (20000, 200000):
+        lines = ["temporalInterpProps: [" + ', '.join("('%s', %.6f)" % pair for pair in zip(models, values)) + "]\n"
+                 for values in rng.dirichlet(np.ones(len(models)), n_records)]
+        parser = log_viewer.MaqtParser(OrderedDict([('cams_ratio', "^temporalInterpProps")]))
+        start = time.perf_counter()
+        for line in lines:
+            parser.feed(line)
+        per_record.append((time.perf_counter() - start) / n_records)
+        assert parser.props_arr.shape == (n_records, len(models))
+
+    assert per_record[1] < 3 * per_record[0]
+
+
+@pytest.mark.parametrize('options', [dict(mmap_threshold=0), dict(jobs=2)], ids=['mmap', 'jobs'])
+def test_parse_paths_agree(log_file, full_df, options):
+    assert log_viewer.Log(log_file, **options).df.equals(full_df)
+
+
+@pytest.mark.parametrize('options', [dict(mmap_threshold=0), dict(jobs=2)], ids=['mmap', 'jobs'])
+def test_lines_holding_several_markers(tmp_path, options):
+    # Each line goes to its leftmost marker, whatever the parsing path
+    filename = str(tmp_path / "collisions.log")
+    generate_maqt_log(filename, N_LINES, collisions=True)
+    text = log_viewer.Log(filename, mmap_threshold=None).df
+    assert len(text) == N_LINES // 12
+    assert log_viewer.Log(filename, **options).df.equals(text)
+
+
+@pytest.mark.parametrize('options', [dict(), dict(mmap_threshold=None), dict(jobs=2),
+                                     dict(index=log_viewer.LogIndex())], ids=['scan', 'text', 'jobs', 'index'])
+def test_date_window_pushdown(log_file, full_df, options):
+    log = log_viewer.Log(log_file, date_from='2015-08-01', date_to='2015-08-31', **options)
+    expected = full_df[(full_df['Date'] >= '2015-08-01') & (full_df['Date'] <= '2015-08-31')]
+    assert len(log.df) == 31
+    assert log.df.equals(expected.reset_index(drop=True))
+
+
+def test_fields_pushdown(log_file, full_df):
+    log = log_viewer.Log(log_file, fields=['cloud_fraction', 'ozone'])
+    assert list(log.df.columns) == ['Date', 'Cloud Fraction (with shadow)', 'Ozone']
+    assert log.df.equals(full_df[list(log.df.columns)])
+    assert [render.__name__ for render, _ in log.figures()] == ['_render_clouds']
+
+    # Slicing a log without aerosol stack
+    assert len(log.window('2015-08-01', '2015-08-10').df) == 10
+
+
+def test_empty_date_window(log_file):
+    log = log_viewer.Log(log_file, date_from='2030-01-01')
+    assert log.df.empty
+    assert os.path.getsize(log.save_table()) > 0
+
+
+def test_not_a_maqt_log(tmp_path):
+    filename = str(tmp_path / "other.log")
+    with open(filename, 'w') as f:
+        f.write("hello\nworld\n")
+    for options in (dict(), dict(date_from='2015-07-01')):
+        with pytest.raises(SystemExit):
+            log_viewer.Log(filename, **options)
+
+
+def test_index_invalidation(log_file, full_df):
+    index = log_viewer.LogIndex()
+    index.build(log_file)
+    assert index.load(log_file) is not None
+
+    with open(log_file, 'a') as f:
+        f.write("L1C date: 20300101 T31TCJ\n")
+    assert index.load(log_file) is None
+    assert index.ranges(log_file, 20300101, 20300101) == [(os.path.getsize(log_file) - 26, os.path.getsize(log_file))]
+
+
+def test_follow_refresh(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reference = str(tmp_path / "reference.log")
+    generate_maqt_log(reference, N_LINES)
+    with open(reference) as f:
+        content = f.read()
+    expected = log_viewer.Log(reference).df
+
+    # Followed from its first line, the first record being still written
+    filename = str(tmp_path / "followed.log")
+    first_line = content.index('\n') + 1
+    with open(filename, 'w') as f:
+        f.write(content[:first_line])
+    log = log_viewer.Log(filename, follow=True)
+    assert log.df.empty
+    table = log.save_table()
+
+    rng = np.random.default_rng(0)
+    position = first_line
+    while position < len(content):
+        step = int(rng.integers(1, 4000))
+        with open(filename, 'a') as f:
+            f.write(content[position:position + step])
+        position += step
+        n_rows = len(log.df)
+        n = log.refresh()
+        assert n == len(log.df) - n_rows
+        assert log.df.equals(expected.iloc[:len(log.df)])
+        if n:
+            log.append_table(n)
+
+    assert len(log.df) == len(expected)
+    heights, bottoms = log_viewer.aerosol_stack(expected[log._props_list].to_numpy())
+    assert np.array_equal(log._aerosol_heights, heights) and np.array_equal(log._aerosol_bottoms, bottoms)
+
+    # Parsed columns hold all the records too, e.g. for a tau-weighted stack
+    weighted = log_viewer.Log(reference, tau_weight=True)
+    assert np.array_equal(log.weighted(True)._aerosol_heights, weighted._aerosol_heights)
+    with open(table) as appended:
+        assert appended.read() == expected.to_csv(index=False)
+
+
+def test_refresh_needs_follow(log_file):
+    with pytest.raises(ValueError):
+        log_viewer.Log(log_file).refresh()
+
+
+@pytest.mark.parametrize('opener, suffix', [(gzip.open, '.gz'), (bz2.open, '.bz2'), (lzma.open, '.xz')])
+@pytest.mark.parametrize('mmap_threshold', [None, 0])
+def test_compressed_logs(log_file, full_df, opener, suffix, mmap_threshold):
+    compressed = _compress(log_file, opener, suffix)
+    log = log_viewer.Log(compressed, mmap_threshold=mmap_threshold)
+    assert log.df.equals(full_df)
+    assert log._log_file_name == os.path.basename(log_file)
+
+
+def test_zstd_log(log_file, full_df):
+    zstandard = pytest.importorskip('zstandard')
+    with open(log_file, 'rb') as f, open(log_file + '.zst', 'wb') as out:
+        out.write(zstandard.ZstdCompressor().compress(f.read()))
+    assert log_viewer.Log(log_file + '.zst', mmap_threshold=0).df.equals(full_df)
+
+
+def test_read_blocks_closed_early():
+    # The read ahead thread stops once the consumer closes the generator
+    n_threads = threading.active_count()
+    blocks = log_viewer._read_blocks(io.BytesIO(b'x' * 100), block_size=10)
+    assert next(blocks) == b'x' * 10
+    blocks.close()
+    assert threading.active_count() == n_threads
+
+
+def test_date_queries(log_file, full_df):
+    log = log_viewer.Log(log_file)
+    dates = full_df['Date']
+    expected = full_df[(dates >= '2015-07-10') & (dates <= '2015-07-20')]
+    assert log.between('2015-07-10', '2015-07-20').equals(expected)
+    assert log.nearest('2015-07-10 13:00')['Date'] == pd.Timestamp('2015-07-11')
+    assert log.nearest('2015-07-10 12:00')['Date'] == pd.Timestamp('2015-07-10')
+    assert log.asof('2015-07-10 23:00')['Date'] == pd.Timestamp('2015-07-10')
+    assert log.asof('2015-06-30') is None
+
+
+def test_date_queries_without_records(log_file):
+    log = log_viewer.Log(log_file).window('2100-01-01')
+    assert log.df.empty and log.between().empty
+    assert log.nearest('2015-07-10') is None and log.asof('2015-07-10') is None
+
+
+def test_batch_reports_errors(log_file, tmp_path):
+    other = str(tmp_path / "other.log")
+    with open(other, 'w') as f:
+        f.write("hello\n")
+    missing = str(tmp_path / "missing.log")
+
+    results = log_viewer.run_batch([log_file, other, missing], workers=2, plots=False)
+    assert [result[1] for result in results] == ['OK', 'FAILED', 'FAILED']
+    assert "Is it really a log of MAQT?" in results[1][2]
+    assert results[2][2] == "file %s not found..." % missing
+    assert os.path.isfile("T31TCJ_table.csv")
+
+
+def test_batch_name_clash(log_file):
+    # A log and its compressed copy would save the same table and plots
+    compressed = _compress(log_file, gzip.open, '.gz')
+    results = log_viewer.run_batch([log_file, compressed], plots=False)
+    assert [result[1] for result in results] == ['OK', 'FAILED']
+    assert results[1][2] == "same table and plot files as %s" % log_file
+
+
+def test_merge_drops_duplicates(tmp_path):
+    # b repeats the first records of a, c has other values on the same dates
+    filenames = [str(tmp_path / name) for name in ("a.log", "b.log", "c.log")]
+    for filename, n_lines, seed in zip(filenames, (N_LINES, N_LINES // 2, N_LINES // 2), (0, 0, 1)):
+        generate_maqt_log(filename, n_lines, seed=seed)
+    logs = [log_viewer.Log(filename) for filename in filenames]
+
+    merged = log_viewer.merge_logs(logs)
+    assert len(merged) == len(logs[0].df) + len(logs[2].df)
+    assert merged.index.is_monotonic_increasing
+    assert merged['Source'].value_counts().to_dict() == {filenames[0]: 200, filenames[1]: 0, filenames[2]: 100}
+
+    kept = log_viewer.merge_logs(logs, drop_duplicates=False)
+    assert len(kept) == sum(len(log.df) for log in logs)
+    assert log_viewer.merge_frames([log.df for log in logs], filenames).equals(merged)
+
+
+def test_batch_keeps_frames(log_file, tmp_path):
+    other = str(tmp_path / "other.log")
+    with open(other, 'w') as f:
+        f.write("hello\n")
+    compressed = _compress(log_file, gzip.open, '.gz')
+
+    results = log_viewer.run_batch([log_file, other, compressed], plots=False, keep_frame=True)
+    assert [result[1] for result in results] == ['OK', 'FAILED', 'FAILED']
+    assert len(results[0][4]) == N_LINES // 12
+    assert results[1][4] is None and results[2][4] is None
+
+
+def test_cache_staleness(log_file, tmp_path):
+    cache = log_viewer.ParseCache(str(tmp_path / "cache"))
+    assert cache.load(log_file) is None
+    first = log_viewer.Log(log_file, cache=cache).df
+    assert cache.load(log_file) is not None
+    assert log_viewer.Log(log_file, cache=cache).df.equals(first)
+
+    # Same size, another content and mtime
+    with open(log_file, 'r+') as f:
+        content = f.read()
+        f.seek(0)
+        f.write(content.replace("ozone = 0.", "ozone = 1.", 1))
+    os.utime(log_file, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    assert cache.load(log_file) is None
+    changed = log_viewer.Log(log_file, cache=cache).df
+    assert changed['Ozone'].iloc[0] == first['Ozone'].iloc[0] + 1
+
+    # Appended records
+    generate_maqt_log(str(tmp_path / "more.log"), 120)
+    with open(log_file, 'a') as f, open(str(tmp_path / "more.log")) as more:
+        f.write(more.read())
+    assert cache.load(log_file) is None
+    assert len(log_viewer.Log(log_file, cache=cache).df) == len(first) + 10
+
+
+def test_cache_entry_evicted_meanwhile(log_file, tmp_path, monkeypatch):
+    cache = log_viewer.ParseCache(str(tmp_path / "cache"))
+    log_viewer.Log(log_file, cache=cache)
+    utime = os.utime
+
+    def evicted(path, *args, **kwargs):
+        os.remove(path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+    assert cache.load(log_file) is not None
+
+
+def test_profile_bypasses_cache(log_file, tmp_path):
+    cache = log_viewer.ParseCache(str(tmp_path / "cache"))
+    log_viewer.Log(log_file, cache=cache)
+    metrics = log_viewer.Log(log_file, cache=cache, profile=True).metrics()
+    assert metrics['counters']['date']['calls'] == N_LINES // 12
+    assert metrics['records'] == N_LINES // 12
+
+
+def test_cache_version(log_file, tmp_path, monkeypatch):
+    cache = log_viewer.ParseCache(str(tmp_path / "cache"))
+    log_viewer.Log(log_file, cache=cache)
+    assert cache.load(log_file) is not None
+
+    # Entries of another parser version are parsed again
+    monkeypatch.setattr(log_viewer.ParseCache, 'version', log_viewer.ParseCache.version + 1)
+    assert cache.load(log_file) is None
+
+
+@pytest.fixture
+def server(log_file, tmp_path):
+    with open(str(tmp_path / "other.log"), 'w') as f:
+        f.write("hello\n")
+    server = log_viewer.make_server(str(tmp_path), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d/" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.headers['Content-Type'], response.read()
+
+    except urllib.error.HTTPError as error:
+        return error.code, None, None
+
+
+def test_server_tables(server, full_df):
+    status, content_type, body = _get(server + "table/T31TCJ.log?from=2015-08-01&to=2015-08-03")
+    assert status == 200 and content_type == 'application/json'
+    assert [record['RH'] for record in json.loads(body)] == full_df['RH'].iloc[31:34].tolist()
+
+    status, content_type, body = _get(server + "table/T31TCJ.log?format=csv&columns=Ozone&tau=1")
+    assert status == 200 and content_type == 'text/csv'
+    assert pd.read_csv(io.BytesIO(body)).columns.tolist() == ['Date', 'Ozone']
+
+    # Tables do not depend on tau: a single parse is kept
+    status, _, body = _get(server + "status")
+    assert status == 200
+    assert [entry['records'] for entry in json.loads(body)] == [len(full_df)]
+
+
+def test_server_plots(server):
+    for query in ("kind=clouds", "kind=aerosols&tau=1&resample=lttb&bins=50"):
+        status, content_type, body = _get(server + "plot/T31TCJ.log?" + query)
+        assert status == 200 and content_type == 'image/png' and body.startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('path, code', [("nowhere", 404), ("table/missing.log", 404), ("table/../../etc/passwd", 404),
+                                        ("plot/T31TCJ.log?kind=pie", 400), ("plot/T31TCJ.log?bins=0", 400),
+                                        ("plot/T31TCJ.log?bins=-5", 400), ("plot/T31TCJ.log?bins=ten", 400),
+                                        ("table/T31TCJ.log?format=xml", 400), ("table/T31TCJ.log?from=someday", 400),
+                                        ("table/other.log", 422)])
+def test_server_errors(server, path, code):
+    assert _get(server + path)[0] == code